@@ -3,17 +3,23 @@ FastAPI Farm Harvest Annotation Tool with JWT Auth & MongoDB
 Complete system with authentication, admin dashboard, and MongoDB Atlas
 Supports both local and S3 storage
 """
-from fastapi import FastAPI, HTTPException, Depends, status, Query
-from fastapi.responses import FileResponse, StreamingResponse, Response
+from fastapi import FastAPI, HTTPException, Depends, status, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse, Response, RedirectResponse
+from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
-import json
+import asyncio
+import threading
+import mimetypes
+import stat
 import csv
 import io
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from dotenv import load_dotenv
+import anyio
+import orjson
 
 # Local imports
 from database import (
@@ -36,16 +42,29 @@ from auth import (
     create_access_token, 
     decode_access_token
 )
-from image_utils import parse_date_from_filename
+from image_utils import (
+    parse_date_from_filename, make_thumbnail, pregenerate_thumbnails,
+    THUMB_CACHE_DIR
+)
 from storage import init_storage, get_storage_instance
 
 load_dotenv()
 
+
+class ORJSONResponse(Response):
+    """JSON response serialized with orjson (FastAPI's own ORJSONResponse is deprecated)"""
+    media_type = "application/json"
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Farm Harvest Annotation Tool API",
     version="3.0",
-    description="API with JWT Auth, MongoDB, and Admin Dashboard"
+    description="API with JWT Auth, MongoDB, and Admin Dashboard",
+    default_response_class=ORJSONResponse
 )
 
 # Security
@@ -60,23 +79,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+class ThumbCacheFiles(StaticFiles):
+    """Static files with long-lived cache headers; cache names change whenever the source image does"""
+    
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=2592000, immutable"
+        return response
+
+
+# Generated thumbnails are served straight from disk, bypassing the API handlers
+os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+app.mount("/thumbcache", ThumbCacheFiles(directory=THUMB_CACHE_DIR), name="thumbcache")
+
+# Edge length of the cached /thumbs thumbnails for local storage; 0 (the
+# default) serves the original image, as S3 storage always does
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "0"))
+
 # Initialize storage backend
 storage = None
+_thumb_warmup_task: Optional[asyncio.Task] = None
+_thumb_warmup_stop = threading.Event()
 
 
 # Startup/Shutdown Events
 @app.on_event("startup")
 async def startup_db_client():
     """Connect to MongoDB and initialize storage on startup"""
-    global storage
+    global storage, _thumb_warmup_task
     await connect_to_mongo()
     await initialize_default_admin()
     storage = init_storage()  # Initialize storage backend
+    
+    # Optionally warm the thumbnail cache in the background (local storage only)
+    if THUMBNAIL_SIZE > 0 and os.getenv("PREGENERATE_THUMBNAILS", "false").lower() == "true":
+        # Paths are collected here, on the loop thread, which owns the farm manifest
+        source_paths = collect_thumbnail_sources()
+        _thumb_warmup_stop.clear()
+        _thumb_warmup_task = asyncio.create_task(pregenerate_all_thumbnails(source_paths))
+        _thumb_warmup_task.add_done_callback(_log_thumb_warmup_failure)
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    """Close MongoDB connection on shutdown"""
+    """Stop the thumbnail warmup and close MongoDB connection on shutdown"""
+    if _thumb_warmup_task is not None and not _thumb_warmup_task.done():
+        # Let the worker thread cancel the queued thumbnails, then wait for it
+        _thumb_warmup_stop.set()
+        await asyncio.gather(_thumb_warmup_task, return_exceptions=True)
     await close_mongo_connection()
 
 
@@ -153,15 +204,29 @@ async def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
 
 # Farm Index and Data Functions
 _FARM_INDEX: Optional[List[Dict[str, str]]] = None
+_FARM_INDEX_MTIME: Optional[int] = None
+
+# farm_id -> [(image_path, (year, month, day)), ...] sorted by date
+_FARM_MANIFEST: Dict[str, List[Tuple[str, Tuple[int, int, int]]]] = {}
+_FARM_MANIFEST_MTIMES: Dict[str, Optional[int]] = {}
+
+# farm_id -> thumbnail lists served by get_farm_data, derived from the manifest
+_FARM_THUMBNAILS: Dict[str, Dict[str, Any]] = {}
 
 
 def build_farm_index(force: bool = False) -> List[Dict[str, str]]:
-    """Build farm index from storage backend"""
-    global _FARM_INDEX
-    if _FARM_INDEX is not None and not force:
+    """Build farm index from storage backend (rebuilt when the dataset root changes)"""
+    global _FARM_INDEX, _FARM_INDEX_MTIME
+    storage_backend = get_storage_instance()
+    mtime = storage_backend.get_mtime()
+    if _FARM_INDEX is not None and not force and mtime == _FARM_INDEX_MTIME:
         return _FARM_INDEX
     
-    storage_backend = get_storage_instance()
+    if force:
+        _FARM_MANIFEST.clear()
+        _FARM_MANIFEST_MTIMES.clear()
+        _FARM_THUMBNAILS.clear()
+    
     farm_list = []
     
     try:
@@ -173,9 +238,139 @@ def build_farm_index(force: bool = False) -> List[Dict[str, str]]:
         farm_list = []
 
     _FARM_INDEX = farm_list
+    _FARM_INDEX_MTIME = mtime
     return _FARM_INDEX
 
 
+def get_farm_images(farm_id: str) -> Optional[List[Tuple[str, Tuple[int, int, int]]]]:
+    """Date-sorted (path, date) list for a farm, or None if the farm doesn't exist.
+    
+    The listing and date parsing happen once per farm; later requests are
+    served from the manifest until the mtime of the farm directory or any
+    folder nested in it changes (local storage) or the index is rebuilt.
+    """
+    storage_backend = get_storage_instance()
+    mtime = storage_backend.get_mtime(farm_id)
+    images = _FARM_MANIFEST.get(farm_id)
+    if images is not None and _FARM_MANIFEST_MTIMES.get(farm_id) == mtime:
+        return images
+    
+    # Stale or missing: drop anything derived from the old listing
+    _FARM_MANIFEST.pop(farm_id, None)
+    _FARM_THUMBNAILS.pop(farm_id, None)
+    
+    if not storage_backend.farm_exists(farm_id):
+        return None
+    
+    images = []
+    for img_path in storage_backend.list_images(farm_id):
+        try:
+            # Create a temporary full path for date parsing
+            date_tuple = parse_date_from_filename(f"/{farm_id}/{img_path}")
+        except Exception:
+            # If date parsing fails, add with default date
+            date_tuple = (1900, 1, 1)
+        images.append((img_path, date_tuple))
+    
+    images.sort(key=lambda x: x[1])
+    _FARM_MANIFEST[farm_id] = images
+    _FARM_MANIFEST_MTIMES[farm_id] = mtime
+    return images
+
+
+def get_farm_thumbnails(farm_id: str) -> Optional[Dict[str, Any]]:
+    """Year-grouped thumbnail lists for a farm plus filename -> index lookups.
+    
+    Built from the manifest once per farm; the result is shared between
+    requests and must not be mutated.
+    """
+    image_data = get_farm_images(farm_id)
+    if image_data is None:
+        return None
+    
+    farm_thumbnails = _FARM_THUMBNAILS.get(farm_id)
+    if farm_thumbnails is not None:
+        return farm_thumbnails
+    
+    # Separate images by year (2024 and 2025)
+    thumbnails_2024 = []
+    thumbnails_2025 = []
+    
+    for idx, (img_path, sort_date) in enumerate(image_data):
+        year, month, day = sort_date
+        
+        month_names = ['', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                      'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+        if month > 0:
+            date_display = f"{month_names[month]} {day}, {year}" if day > 0 else f"{month_names[month]} {year}"
+        else:
+            date_display = f"{year}" if year > 1900 else "Unknown"
+        
+        thumb_data = {
+            'index': idx,
+            'filename': img_path,
+            'date_display': date_display,
+            'sort_date': sort_date,
+            'original_path': img_path
+        }
+        
+        # Group by year
+        if year == 2024:
+            thumbnails_2024.append(thumb_data)
+        elif year == 2025:
+            thumbnails_2025.append(thumb_data)
+    
+    thumbnails_2024.sort(key=lambda x: x['sort_date'])
+    thumbnails_2025.sort(key=lambda x: x['sort_date'])
+    
+    # Reindex thumbnails within each year group
+    for idx, thumb in enumerate(thumbnails_2024):
+        thumb['index'] = idx
+    for idx, thumb in enumerate(thumbnails_2025):
+        thumb['index'] = idx
+    
+    farm_thumbnails = {
+        'image_count': len(image_data),
+        'thumbnails_2024': thumbnails_2024,
+        'thumbnails_2025': thumbnails_2025,
+        'index_2024': {thumb['filename']: thumb['index'] for thumb in thumbnails_2024},
+        'index_2025': {thumb['filename']: thumb['index'] for thumb in thumbnails_2025}
+    }
+    _FARM_THUMBNAILS[farm_id] = farm_thumbnails
+    return farm_thumbnails
+
+
+def collect_thumbnail_sources() -> List[str]:
+    """Local paths of every farm image, or an empty list if storage isn't local"""
+    storage_backend = get_storage_instance()
+    source_paths = []
+    for farm in build_farm_index():
+        farm_id = farm['farm_id']
+        for img_path, _ in get_farm_images(farm_id) or []:
+            source_path = storage_backend.get_local_path(farm_id, img_path)
+            if source_path is None:
+                return []
+            source_paths.append(source_path)
+    return source_paths
+
+
+async def pregenerate_all_thumbnails(source_paths: List[str]):
+    """Generate the missing THUMBNAIL_SIZE thumbnails for `source_paths` off the event loop"""
+    # Half the cores, so the pool doesn't starve request handling
+    max_workers = max(1, (os.cpu_count() or 2) // 2)
+    generated = await anyio.to_thread.run_sync(
+        lambda: pregenerate_thumbnails(source_paths, THUMBNAIL_SIZE, THUMBNAIL_SIZE,
+                                       max_workers=max_workers, stop=_thumb_warmup_stop)
+    )
+    print(f"[INFO] Pre-generated {generated} thumbnails for {len(source_paths)} images")
+
+
+def _log_thumb_warmup_failure(task: asyncio.Task):
+    """Report a failed thumbnail warmup instead of leaving the exception unretrieved"""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[ERROR] Thumbnail pre-generation failed: {task.exception()!r}")
+
+
 # Build index on startup (after storage is initialized)
 # Will be called from startup event
 
@@ -400,8 +595,8 @@ async def create_assignment(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Get all farms
-    all_farms = build_farm_index()
+    # Get all farms (the index rebuild lists the storage backend, so run it off the loop)
+    all_farms = await anyio.to_thread.run_sync(build_farm_index)
     all_farm_ids = [f["farm_id"] for f in all_farms]
     
     # Get already assigned farms
@@ -506,22 +701,31 @@ async def get_admin_stats(admin: dict = Depends(require_admin)):
     total_assignments = await db[ASSIGNMENTS_COLLECTION].count_documents({})
     
     # Get farms count
-    farms = build_farm_index()
+    farms = await anyio.to_thread.run_sync(build_farm_index)
     total_farms = len(farms)
     
     # Get assigned farms count
     assignments = await db[ASSIGNMENTS_COLLECTION].find().to_list(1000)
     assigned_farms = set()
+    assignment_by_user = {}
     for assignment in assignments:
         assigned_farms.update(assignment.get("farm_ids", []))
+        assignment_by_user.setdefault(assignment.get("user_id"), assignment)
+    
+    # Annotation counts for all users in one aggregation instead of a query per user
+    annotation_counts = {}
+    async for row in db[ANNOTATIONS_COLLECTION].aggregate([
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+    ]):
+        annotation_counts[row["_id"]] = row["count"]
     
     # Get user stats
     user_stats = []
     users = await db[USERS_COLLECTION].find({"role": "annotator"}).to_list(1000)
     for user in users:
         user_id = str(user["_id"])
-        annotations_count = await db[ANNOTATIONS_COLLECTION].count_documents({"user_id": user_id})
-        assignment = await db[ASSIGNMENTS_COLLECTION].find_one({"user_id": user_id})
+        annotations_count = annotation_counts.get(user_id, 0)
+        assignment = assignment_by_user.get(user_id)
         assigned_count = len(assignment.get("farm_ids", [])) if assignment else 0
         
         user_stats.append({
@@ -662,73 +866,11 @@ async def get_farm_data(farm_id: str, current_user: dict = Depends(get_current_u
             detail="This farm is not assigned to you"
         )
     
-    # Get farm images
-    storage_backend = get_storage_instance()
-    
-    if not storage_backend.farm_exists(farm_id):
+    # Get the farm's year-grouped thumbnail lists (built once per farm)
+    farm_thumbnails = await anyio.to_thread.run_sync(get_farm_thumbnails, farm_id)
+    if farm_thumbnails is None:
         raise HTTPException(status_code=404, detail="Farm not found")
     
-    # Get all image paths from storage
-    image_paths = storage_backend.list_images(farm_id)
-    
-    # Sort by date
-    image_data = []
-    for img_path in image_paths:
-        try:
-            # Create a temporary full path for date parsing
-            temp_path = f"/{farm_id}/{img_path}"
-            date_tuple = parse_date_from_filename(temp_path)
-            image_data.append({
-                'path': img_path,
-                'date': date_tuple
-            })
-        except Exception:
-            # If date parsing fails, add with default date
-            image_data.append({
-                'path': img_path,
-                'date': (1900, 1, 1)
-            })
-    
-    image_data.sort(key=lambda x: x['date'])
-    
-    # Separate images by year (2024 and 2025)
-    thumbnails_2024 = []
-    thumbnails_2025 = []
-    
-    for idx, img_info in enumerate(image_data):
-        img_path = img_info['path']
-        year, month, day = img_info['date']
-        
-        month_names = ['', 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-                      'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-        if month > 0:
-            date_display = f"{month_names[month]} {day}, {year}" if day > 0 else f"{month_names[month]} {year}"
-        else:
-            date_display = f"{year}" if year > 1900 else "Unknown"
-        
-        thumb_data = {
-            'index': idx,
-            'filename': img_path,
-            'date_display': date_display,
-            'sort_date': img_info['date'],
-            'original_path': img_path
-        }
-        
-        # Group by year
-        if year == 2024:
-            thumbnails_2024.append(thumb_data)
-        elif year == 2025:
-            thumbnails_2025.append(thumb_data)
-    
-    thumbnails_2024.sort(key=lambda x: x['sort_date'])
-    thumbnails_2025.sort(key=lambda x: x['sort_date'])
-    
-    # Reindex thumbnails within each year group
-    for idx, thumb in enumerate(thumbnails_2024):
-        thumb['index'] = idx
-    for idx, thumb in enumerate(thumbnails_2025):
-        thumb['index'] = idx
-    
     # Check if user has already annotated this farm
     existing_annotation = await db[ANNOTATIONS_COLLECTION].find_one({
         "user_id": current_user["id"],
@@ -743,22 +885,16 @@ async def get_farm_data(farm_id: str, current_user: dict = Depends(get_current_u
         selected_image_2025 = existing_annotation.get("selected_image_2025")
         
         if selected_image_2024:
-            for idx, thumb in enumerate(thumbnails_2024):
-                if thumb['filename'] == selected_image_2024:
-                    selected_index_2024 = idx
-                    break
+            selected_index_2024 = farm_thumbnails['index_2024'].get(selected_image_2024)
         
         if selected_image_2025:
-            for idx, thumb in enumerate(thumbnails_2025):
-                if thumb['filename'] == selected_image_2025:
-                    selected_index_2025 = idx
-                    break
+            selected_index_2025 = farm_thumbnails['index_2025'].get(selected_image_2025)
     
     return {
         'farm_id': farm_id,
-        'image_count': len(image_data),
-        'thumbnails_2024': thumbnails_2024,
-        'thumbnails_2025': thumbnails_2025,
+        'image_count': farm_thumbnails['image_count'],
+        'thumbnails_2024': farm_thumbnails['thumbnails_2024'],
+        'thumbnails_2025': farm_thumbnails['thumbnails_2025'],
         'selected_index_2024': selected_index_2024,
         'selected_index_2025': selected_index_2025
     }
@@ -856,47 +992,134 @@ async def get_annotator_stats(current_user: dict = Depends(get_current_user)):
 # IMAGE SERVING ROUTES (Public - No Auth Required)
 # ============================================================================
 
+def image_bytes_response(request: Request, image_data: bytes, media_type: str) -> Response:
+    """Response for in-memory image bytes, honouring a single `Range: bytes=` request.
+    FileResponse handles ranges itself for files on disk.
+    """
+    headers = {"Cache-Control": "public, max-age=2592000", "Accept-Ranges": "bytes"}
+    size = len(image_data)
+    range_header = request.headers.get("range", "")
+    
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return Response(content=image_data, media_type=media_type, headers=headers)
+    
+    # Syntactically invalid ranges are ignored (RFC 9110 14.2), as FileResponse does
+    start_str, _, end_str = range_header[6:].strip().partition("-")
+    if not (start_str + end_str).isdigit():
+        return Response(content=image_data, media_type=media_type, headers=headers)
+    if start_str:
+        start = int(start_str)
+        if end_str and int(end_str) < start:
+            return Response(content=image_data, media_type=media_type, headers=headers)
+        end = min(int(end_str), size - 1) if end_str else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(end_str), 0)
+        end = size - 1
+    
+    # Valid but unsatisfiable: starts past the end (or an empty suffix)
+    if start >= size:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return Response(content=image_data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+
 @app.get("/thumbnails/{farm_id}/{filename:path}")
-async def serve_image(farm_id: str, filename: str):
+async def serve_image(farm_id: str, filename: str, request: Request):
     """Serve original images from storage backend"""
     storage_backend = get_storage_instance()
     
-    if not storage_backend.farm_exists(farm_id):
+    # Local files: one stat, then FileResponse streams the file (sendfile
+    # where the server supports it, and Range requests) instead of reading it into memory
+    source_path = storage_backend.get_local_path(farm_id, filename)
+    if source_path is not None:
+        try:
+            stat_result = os.stat(source_path)
+        except OSError:
+            stat_result = None
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            return FileResponse(
+                source_path,
+                media_type=mimetypes.guess_type(filename)[0] or 'image/png',
+                stat_result=stat_result,
+                headers={"Cache-Control": "public, max-age=2592000"}
+            )
+    
+    if not await anyio.to_thread.run_sync(storage_backend.farm_exists, farm_id):
         raise HTTPException(status_code=404, detail='Invalid farm id')
     
-    if not storage_backend.image_exists(farm_id, filename):
+    if not await anyio.to_thread.run_sync(storage_backend.image_exists, farm_id, filename):
         raise HTTPException(status_code=404, detail='File not found')
     
     try:
         # Get image content from storage
-        image_data = storage_backend.get_image(farm_id, filename)
+        image_data = await anyio.to_thread.run_sync(storage_backend.get_image, farm_id, filename)
         
         # Return as response
-        response = Response(content=image_data, media_type='image/png')
-        response.headers["Cache-Control"] = "public, max-age=2592000"
-        return response
+        media_type = mimetypes.guess_type(filename)[0] or 'image/png'
+        return image_bytes_response(request, image_data, media_type)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail='File not found')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f'Error loading image: {str(e)}')
 
 
+# Per-thumbnail locks so concurrent requests for the same image decode it only once
+_thumb_locks: Dict[str, asyncio.Lock] = {}
+_THUMB_LOCKS_MAX = 1024
+
+
+async def get_thumbnail(source_path: str, width: int, height: int) -> Optional[str]:
+    """Return the cached thumbnail path, generating it off the event loop if needed"""
+    lock_key = f"{source_path}:{width}x{height}"
+    
+    if len(_thumb_locks) > _THUMB_LOCKS_MAX:
+        for key in [k for k, lock in _thumb_locks.items() if not lock.locked()]:
+            del _thumb_locks[key]
+    
+    async with _thumb_locks.setdefault(lock_key, asyncio.Lock()):
+        return await anyio.to_thread.run_sync(make_thumbnail, source_path, width, height)
+
+
 @app.get("/thumbs/{farm_id}/{filename:path}")
-async def serve_thumb(farm_id: str, filename: str):
+async def serve_thumb(farm_id: str, filename: str, request: Request):
     """Serve thumbnail from storage backend"""
     storage_backend = get_storage_instance()
     
-    if not storage_backend.image_exists(farm_id, filename):
+    if not await anyio.to_thread.run_sync(storage_backend.image_exists, farm_id, filename):
         raise HTTPException(status_code=404, detail='File not found')
     
+    # With THUMBNAIL_SIZE set, local files get a cached thumbnail, then a
+    # temporary redirect to the static /thumbcache copy; otherwise the
+    # original is served. The redirect itself is not cached: the cache can
+    # be cleared, and only this route regenerates missing thumbnails
+    source_path = storage_backend.get_local_path(farm_id, filename)
+    if source_path is not None:
+        if THUMBNAIL_SIZE > 0:
+            thumb_path = await get_thumbnail(source_path, THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+            if thumb_path is not None:
+                return RedirectResponse(
+                    f"/thumbcache/{os.path.relpath(thumb_path, THUMB_CACHE_DIR).replace(os.sep, '/')}",
+                    status_code=307,
+                    headers={"Cache-Control": "no-cache"}
+                )
+        
+        # Original requested, or undecodable for a thumbnail: stream it from disk
+        return FileResponse(
+            source_path,
+            media_type=mimetypes.guess_type(filename)[0] or 'image/png',
+            headers={"Cache-Control": "public, max-age=2592000"}
+        )
+    
     try:
         # Get image content from storage
-        image_data = storage_backend.get_image(farm_id, filename)
+        image_data = await anyio.to_thread.run_sync(storage_backend.get_image, farm_id, filename)
         
         # Return as response
-        response = Response(content=image_data, media_type='image/png')
-        response.headers["Cache-Control"] = "public, max-age=2592000"
-        return response
+        media_type = mimetypes.guess_type(filename)[0] or 'image/png'
+        return image_bytes_response(request, image_data, media_type)
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail='File not found')
     except Exception as e:
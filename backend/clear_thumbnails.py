@@ -2,53 +2,50 @@
 """
 Thumbnail management utility for Farm Harvest Annotation Tool
 
-NOTE: As of the latest version, thumbnails are generated on-demand 
-and not saved to disk, so this script is no longer needed.
-However, it's kept for reference and in case you want to clear 
-any old thumbnail files that might exist.
+Thumbnails are generated on first request and cached on disk in
+thumbnail_cache/, sharded into subdirectories by the first two characters
+of the source hash; ImageProcessor keeps its base64 data URLs in
+thumbnail_data_urls/. This script removes both caches so they are rebuilt
+on demand (e.g. after changing the thumbnail rendering).
 """
 
 import os
+import shutil
 
 def main():
-    app_dir = os.path.dirname(os.path.abspath(__file__))
-    thumbnails_dir = os.path.join(app_dir, 'static', 'thumbnails')
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    cache_dirs = [
+        os.path.join(root_dir, 'thumbnail_cache'),
+        os.path.join(root_dir, 'thumbnail_data_urls'),
+    ]
     
     print("🖼️  Farm Harvest Annotation - Thumbnail Management")
     print("=" * 50)
     
-    if os.path.exists(thumbnails_dir):
-        # Count existing files
-        thumbnail_files = [f for f in os.listdir(thumbnails_dir) if f.endswith('.png')]
+    cache_dirs = [d for d in cache_dirs if os.path.exists(d)]
+    if cache_dirs:
+        # Count cached files across all shards
+        thumbnail_count = sum(len(files) for d in cache_dirs for _, _, files in os.walk(d))
         
-        if thumbnail_files:
-            print(f"📁 Found {len(thumbnail_files)} old thumbnail files")
+        if thumbnail_count:
+            print(f"📁 Found {thumbnail_count} cached thumbnail files")
             
-            response = input("Do you want to remove these old files? (y/N): ")
+            response = input("Do you want to remove these files? (y/N): ")
             if response.lower() in ['y', 'yes']:
-                for file in thumbnail_files:
-                    file_path = os.path.join(thumbnails_dir, file)
-                    os.remove(file_path)
-                    print(f"🗑️  Removed: {file}")
-                
-                # Remove directory if empty
-                try:
-                    os.rmdir(thumbnails_dir)
-                    print(f"📁 Removed empty directory: {thumbnails_dir}")
-                except OSError:
-                    print(f"📁 Directory not empty, keeping: {thumbnails_dir}")
-                
+                for thumbnails_dir in cache_dirs:
+                    shutil.rmtree(thumbnails_dir)
+                    print(f"🗑️  Removed: {thumbnails_dir}")
                 print("✅ Cleanup completed!")
             else:
                 print("ℹ️  No files removed")
         else:
-            print("✅ No old thumbnail files found")
+            print("✅ No cached thumbnail files found")
     else:
-        print("ℹ️  No thumbnails directory found")
+        print("ℹ️  No thumbnail cache directory found")
     
-    print("\n📝 Note: The current version generates thumbnails on-demand")
-    print("   and doesn't save them to disk, so this cleanup is not")
-    print("   typically needed anymore.")
+    print("\n📝 Note: Thumbnails are regenerated on the next request,")
+    print("   or at startup when PREGENERATE_THUMBNAILS=true.")
+    print("   Stop the backend before clearing the cache.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
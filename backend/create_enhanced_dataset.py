@@ -9,25 +9,44 @@ import os
 import shutil
 import argparse
 import rasterio
-from rasterio.mask import mask
-from rasterio.warp import transform_geom
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask, geometry_window
+from rasterio.warp import transform
 from rasterio.crs import CRS
-from shapely.geometry import Polygon, mapping
+import shapely
 import pandas as pd
 from datetime import datetime
 import re
-from pathlib import Path
 import numpy as np
 from PIL import Image
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from threading import Lock
 import time
 
+from png_pipeline import (
+    aggressive_stretch, get_temporal_images_from_imgs_24_25, init_gdal_worker, worker_gdal_threads
+)
+
+try:
+    # Optional: pyarrow's multithreaded CSV parser for the farm CSV
+    import pyarrow  # noqa: F401
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    CSV_ENGINE = 'c'
+
 # Global variables for thread safety
 print_lock = Lock()
 progress_lock = Lock()
-completed_farms = 0
-total_farms = 0
+completed_files = 0
+total_files = 0
+
+# Farm polygons transformed into each TIFF CRS seen so far (keyed by WKT);
+# dated images normally share one CRS, so PROJ only runs once per run
+farm_geoms_lock = Lock()
+farm_geoms_by_crs = {}
+
+# Per-process state of pool workers, set up once by init_worker
+worker_farm_polygons = None
 
 def thread_safe_print(message):
     """Thread-safe printing"""
@@ -36,11 +55,10 @@ def thread_safe_print(message):
 
 def update_progress():
     """Thread-safe progress update"""
-    global completed_farms
+    global completed_files
     with progress_lock:
-        completed_farms += 1
-        if completed_farms % 10 == 0 or completed_farms == total_farms:
-            thread_safe_print(f"✅ Progress: {completed_farms}/{total_farms} farms completed ({completed_farms/total_farms*100:.1f}%)")
+        completed_files += 1
+        thread_safe_print(f"✅ Progress: {completed_files}/{total_files} images completed ({completed_files/total_files*100:.1f}%)")
 
 def load_farm_coordinates(csv_file):
     """
@@ -48,7 +66,7 @@ def load_farm_coordinates(csv_file):
     Returns a dictionary with farm_id as key and polygon as value
     """
     try:
-        df = pd.read_csv(csv_file, dtype=str)
+        df = pd.read_csv(csv_file, dtype=str, engine=CSV_ENGINE)
         farm_polygons = {}
 
         # Detect farm id column
@@ -81,38 +99,58 @@ def load_farm_coordinates(csv_file):
         # WKT fallback
         wkt_col = next((c for c in df.columns if c.upper() == 'WKT' or c.lower() == 'wkt'), None)
 
-        for _, row in df.iterrows():
-            # Determine farm id
-            if farm_id_col and pd.notna(row.get(farm_id_col)):
-                farm_id = str(row.get(farm_id_col)).strip()
-            else:
-                # fallback to index-based id
-                farm_id = str(_)
+        # Pull ids and coordinates out as whole columns instead of going row by row
+        if farm_id_col:
+            ids = df[farm_id_col]
+            farm_ids = np.where(ids.notna(), ids.astype(str).str.strip(), df.index.astype(str))
+        else:
+            # fallback to index-based id
+            farm_ids = df.index.astype(str).to_numpy()
+        has_wkt = df[wkt_col].notna().to_numpy() if wkt_col else np.zeros(len(df), dtype=bool)
+
+        if lat_col and lon_col:
+            # Simple 4-point Lang/Long columns: Lang1..Lang4 / Long1..Long4
+            def corner_columns(col):
+                return [col] + [col.replace('1', k) for k in '234']
+
+            def coordinate_array(cols):
+                return np.column_stack([
+                    pd.to_numeric(df[c], errors='coerce') if c in df.columns else np.full(len(df), np.nan)
+                    for c in cols
+                ])
+
+            lons = coordinate_array(corner_columns(lon_col))
+            lats = coordinate_array(corner_columns(lat_col))
+            has_coords = (df[lat_col].notna() & df[lon_col].notna()).to_numpy()
+            valid_coords = ~(np.isnan(lons).any(axis=1) | np.isnan(lats).any(axis=1))
+
+            # Build and buffer every corner polygon in one GEOS call each
+            # (approx ~5 meters in degrees); WKT rows take precedence
+            corner_rows = np.flatnonzero(has_coords & valid_coords & ~has_wkt)
+            rings = np.stack([lons[corner_rows], lats[corner_rows]], axis=-1)
+            rings = np.concatenate([rings, rings[:, :1]], axis=1)
+            corner_polygons = dict(zip(corner_rows, shapely.buffer(shapely.polygons(rings), 0.000045, quad_segs=16)))
+        else:
+            has_coords = np.zeros(len(df), dtype=bool)
 
+        for i, farm_id in enumerate(farm_ids):
             try:
-                if wkt_col and pd.notna(row.get(wkt_col)):
+                if has_wkt[i]:
                     # Use WKT geometry if present
                     try:
                         from shapely import wkt
-                        poly = wkt.loads(row.get(wkt_col))
+                        poly = wkt.loads(df[wkt_col].iat[i])
                     except Exception:
                         # If shapely.wkt not available, skip
                         thread_safe_print(f"⚠️  Skipping farm {farm_id}: invalid WKT")
                         continue
-                elif lat_col and lon_col and pd.notna(row.get(lat_col)) and pd.notna(row.get(lon_col)):
-                    # Use simple 4-point Lang/Long columns
-                    try:
-                        coords = [
-                            (float(row.get(lon_col)), float(row.get(lat_col))),
-                            (float(row.get(lon_col.replace('1','2'))), float(row.get(lat_col.replace('1','2')))),
-                            (float(row.get(lon_col.replace('1','3'))), float(row.get(lat_col.replace('1','3')))),
-                            (float(row.get(lon_col.replace('1','4'))), float(row.get(lat_col.replace('1','4')))),
-                            (float(row.get(lon_col)), float(row.get(lat_col)))
-                        ]
-                        poly = Polygon(coords)
-                    except Exception as e:
-                        thread_safe_print(f"⚠️  Skipping farm {farm_id}: Invalid coordinates: {e}")
+                elif has_coords[i]:
+                    if not valid_coords[i]:
+                        thread_safe_print(f"⚠️  Skipping farm {farm_id}: Invalid coordinates")
                         continue
+                    # Already buffered above
+                    farm_polygons[farm_id] = corner_polygons[i]
+                    continue
                 else:
                     # No usable coordinates
                     thread_safe_print(f"⚠️  Skipping farm {farm_id}: missing coordinate columns")
@@ -132,248 +170,166 @@ def load_farm_coordinates(csv_file):
         thread_safe_print(f"❌ Error loading farm coordinates: {e}")
         return {}
 
-def aggressive_stretch(rgb_array, percentile_range=(0.5, 99.5)):
-    """Apply aggressive contrast stretching for better visualization"""
-    result = np.zeros_like(rgb_array, dtype=np.float64)
-    for i in range(3):
-        band = rgb_array[:, :, i].astype(np.float64)
-        non_zero = band[band > 0]
-        if len(non_zero) > 0:
-            p_low, p_high = np.percentile(non_zero, percentile_range)
-        else:
-            p_low, p_high = np.percentile(band, percentile_range)
-        if p_high > p_low:
-            result[:, :, i] = (band - p_low) / (p_high - p_low)
-        else:
-            result[:, :, i] = band / np.max(band) if np.max(band) > 0 else band
-    return np.clip(result * 255, 0, 255).astype(np.uint8)
-
-def extract_farm_thumbnail(src_path, farm_id, farm_polygon, output_path, save_as_png=True, target_size=(500, 500)):
+def extract_farm_thumbnail(src, farm_id, farm_geom, output_path, save_as_png=True, target_size=(500, 500), jpeg=False):
     """
-    Extract a single farm thumbnail from a big TIFF file
+    Extract a single farm thumbnail from an open big TIFF dataset.
+    `farm_geom` is the farm polygon, already in the TIFF's CRS.
+    With `jpeg`, the RGB thumbnail is written as JPEG instead of PNG.
     """
     try:
-        with rasterio.open(src_path) as src:
-            # Transform polygon from WGS84 to the TIFF's CRS
-            src_crs = CRS.from_epsg(4326)  # WGS84 (lat/lon)
-            dst_crs = src.crs  # TIFF's CRS
+        geojson_geom = [farm_geom]
+        
+        # Read only the window covering the farm (and, for PNG, only the
+        # three display bands) instead of going through rasterio.mask
+        window = geometry_window(src, geojson_geom)
+        rgb_only = save_as_png and src.count >= 4
+        out_image = src.read(indexes=[4, 3, 2] if rgb_only else None, window=window)
+        out_transform = src.window_transform(window)
+        
+        # Blank out pixels outside the farm polygon
+        outside = geometry_mask(geojson_geom, out_shape=out_image.shape[1:], transform=out_transform)
+        out_image[:, outside] = src.nodata if src.nodata is not None else 0
+        
+        if rgb_only:
+            # Convert to RGB PNG with enhanced contrast
+            rgb_composite = np.transpose(out_image, (1, 2, 0))
             
-            # Transform the geometry
-            farm_geom = mapping(farm_polygon)
-            transformed_geom = transform_geom(src_crs, dst_crs, farm_geom)
+            # Handle invalid values
+            if np.any(np.isnan(rgb_composite)) or np.any(np.isinf(rgb_composite)):
+                rgb_composite = np.nan_to_num(rgb_composite, nan=0.0, posinf=0.0, neginf=0.0)
             
-            # Convert back to polygon for masking
-            geojson_geom = [transformed_geom]
+            # Apply aggressive contrast stretching
+            rgb_enhanced = aggressive_stretch(rgb_composite)
             
-            # Extract the farm area
-            out_image, out_transform = mask(src, geojson_geom, crop=True)
+            # Create PIL image and resize
+            img = Image.fromarray(rgb_enhanced)
+            img = img.resize(target_size, Image.Resampling.LANCZOS)
+            
+            if jpeg:
+                # Much smaller and faster to encode than PNG for satellite imagery
+                jpg_output_path = os.path.splitext(output_path)[0] + '.jpg'
+                img.save(jpg_output_path, format='JPEG', quality=85, progressive=True)
+                return jpg_output_path
+            
+            # Change extension to .png
+            png_output_path = os.path.splitext(output_path)[0] + '.png'
+            img.save(png_output_path, format='PNG', optimize=True)
+            return png_output_path
+        else:
+            # Save as a tiled TIFF with internal overviews, so thumbnail reads
+            # decode a pre-downsampled level instead of the full raster
+            out_meta = src.meta.copy()
+            out_meta.update({
+                "driver": "GTiff",
+                "height": out_image.shape[1],
+                "width": out_image.shape[2],
+                "transform": out_transform,
+                "compress": "lzw",
+                "tiled": True,
+                "blockxsize": 256,
+                "blockysize": 256
+            })
+            
+            with rasterio.open(output_path, "w", **out_meta) as dest:
+                dest.write(out_image)
+                dest.build_overviews([2, 4, 8], Resampling.average)
+                dest.update_tags(ns='rio_overview', resampling='average')
+            return output_path
             
-            if save_as_png and out_image.shape[0] >= 4:
-                # Convert to RGB PNG with enhanced contrast
-                rgb_composite = np.stack([out_image[3], out_image[2], out_image[1]], axis=-1)
-                
-                # Handle invalid values
-                if np.any(np.isnan(rgb_composite)) or np.any(np.isinf(rgb_composite)):
-                    rgb_composite = np.nan_to_num(rgb_composite, nan=0.0, posinf=0.0, neginf=0.0)
-                
-                # Apply aggressive contrast stretching
-                rgb_enhanced = aggressive_stretch(rgb_composite)
-                
-                # Create PIL image and resize
-                img = Image.fromarray(rgb_enhanced)
-                img = img.resize(target_size, Image.Resampling.LANCZOS)
-                
-                # Change extension to .png
-                png_output_path = os.path.splitext(output_path)[0] + '.png'
-                img.save(png_output_path, format='PNG', optimize=True)
-                return png_output_path
-            else:
-                # Save as TIFF
-                out_meta = src.meta.copy()
-                out_meta.update({
-                    "driver": "GTiff",
-                    "height": out_image.shape[1],
-                    "width": out_image.shape[2],
-                    "transform": out_transform,
-                    "compress": "lzw"
-                })
-                
-                with rasterio.open(output_path, "w", **out_meta) as dest:
-                    dest.write(out_image)
-                return output_path
-                
     except Exception as e:
-        thread_safe_print(f"❌ Failed to extract farm {farm_id} from {src_path}: {e}")
+        thread_safe_print(f"❌ Failed to extract farm {farm_id} from {src.name}: {e}")
         return None
 
-def parse_date_from_path(folder_path):
-    """
-    Parse date information from folder structure
-    Expected format: imgs_24_25/Month/DayMonth/
-    e.g., imgs_24_25/Oct/11Oct/ -> (2024, 10, 11)
-         imgs_24_25/Nov/28Nov/ -> (2024, 11, 28)
-         imgs_24_25/March/12Mar/ -> (2025, 3, 12)
-         imgs_24_25/April/24Apr/ -> (2025, 4, 24)
-    """
-    parts = Path(folder_path).parts
-    
-    # Find month and day from path
-    month_name = None
-    day_month = None
-    
-    for part in parts:
-        if part in ['Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'March', 'April']:
-            month_name = part
-        elif part.endswith(('Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'Mar', 'Apr')):
-            day_month = part
-    
-    if not month_name or not day_month:
-        return None
-    
-    # Extract day from day_month (e.g., "11Oct" -> 11, "12Mar" -> 12)
-    day_match = re.match(r'(\d+)', day_month)
-    if not day_match:
-        return None
-    
-    day = int(day_match.group(1))
-    
-    # Month mapping
-    month_map = {
-        'Oct': 10, 'Nov': 11, 'Dec': 12,
-        'Jan': 1, 'Feb': 2, 'March': 3, 'April': 4
-    }
-    
-    month = month_map.get(month_name)
-    if not month:
-        return None
-    
-    # Determine year based on month
-    if month >= 10:  # Oct, Nov, Dec
-        year = 2024
-    else:  # Jan, Feb, March, April
-        year = 2025
-    
-    return (year, month, day)
-    """
-    Parse date information from folder structure
-    Expected format: imgs_24_25/Month/DayMonth/
-    e.g., imgs_24_25/Oct/11Oct/ -> (2024, 10, 11)
-         imgs_24_25/Nov/28Nov/ -> (2024, 11, 28)
-    """
-    parts = Path(folder_path).parts
-    
-    # Find month and day from path
-    month_name = None
-    day_month = None
-    
-    for part in parts:
-        if part in ['Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'March', 'April']:
-            month_name = part
-        elif part.endswith(('Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'March', 'April')):
-            day_month = part
-    
-    if not month_name or not day_month:
-        return None
-    
-    # Extract day from day_month (e.g., "11Oct" -> 11)
-    day_match = re.match(r'(\d+)', day_month)
-    if not day_match:
-        return None
-    
-    day = int(day_match.group(1))
-    
-    # Month mapping
-    month_map = {
-        'Oct': 10, 'Nov': 11, 'Dec': 12,
-        'Jan': 1, 'Feb': 2, 'March': 3, 'April': 4
-    }
-    
-    month = month_map.get(month_name)
-    if not month:
-        return None
-    
-    # Determine year based on month
-    if month >= 10:  # Oct, Nov, Dec
-        year = 2024
-    else:  # Jan, Feb, March, April
-        year = 2025
-    
-    return (year, month, day)
-
 def get_temporal_tiff_files(imgs_24_25_dir):
     """
     Scan the imgs_24_25 directory and find all TIFF files with proper date parsing
     Returns a list of tuples: (date_tuple, file_path, date_name)
     """
     tiff_files = []
-    
-    for root, dirs, files in os.walk(imgs_24_25_dir):
-        for file in files:
-            if file.endswith('.tif') and not file.endswith('_udm2.tif'):
-                file_path = os.path.join(root, file)
-                
-                # Parse date from folder path
-                date_tuple = parse_date_from_path(root)
-                
-                if date_tuple:
-                    year, month, day = date_tuple
-                    # Create consistent date naming
-                    date_name = f"{year:04d}_{month:02d}_{day:02d}"
-                    tiff_files.append((date_tuple, file_path, date_name))
-                    thread_safe_print(f"📅 Found: {date_name} -> {file_path}")
-    
+    for date_tuple, file_path, png_name in get_temporal_images_from_imgs_24_25(imgs_24_25_dir):
+        # Consistent date naming, without the extension
+        date_name = os.path.splitext(png_name)[0]
+        tiff_files.append((date_tuple, file_path, date_name))
+        thread_safe_print(f"📅 Found: {date_name} -> {file_path}")
     return tiff_files
 
-def process_single_farm_temporal(args):
-    """Process a single farm across all temporal images"""
-    farm_id, farm_polygon, temporal_files, output_dir, save_as_png = args
+def get_farm_geoms(farm_polygons, dst_crs):
+    """Return the farm polygons reprojected to `dst_crs`, transforming once per CRS"""
+    key = dst_crs.to_wkt()
+    with farm_geoms_lock:
+        farm_geoms = farm_geoms_by_crs.get(key)
+        if farm_geoms is None:
+            src_crs = CRS.from_epsg(4326)  # WGS84 (lat/lon)
+            
+            def reproject(coords):
+                # Every vertex of every farm in a single PROJ call
+                xs, ys = transform(src_crs, dst_crs, coords[:, 0], coords[:, 1])
+                return np.column_stack([xs, ys])
+            
+            farm_geoms = shapely.transform(list(farm_polygons.values()), reproject)
+            farm_geoms_by_crs[key] = farm_geoms
+    return farm_geoms
+
+def init_worker(farm_polygons, gdal_threads=1):
+    """Process pool initializer: keep the farm polygons and a GDAL environment for the worker's lifetime"""
+    global worker_farm_polygons
+    worker_farm_polygons = farm_polygons
+    init_gdal_worker(gdal_threads)
+
+def process_single_tiff_temporal(args):
+    """Extract all farms from a single temporal TIFF, opening it only once"""
+    date_name, tiff_path, output_dir, save_as_png, jpeg = args
+    farm_polygons = worker_farm_polygons
     
     try:
-        # Create output directory for this farm
-        # Some input CSVs append a suffix like `_1` or `_2` to farm_id (from plot numbers).
-        # For folder names we want the canonical farm id only (strip trailing _<number>).
-        folder_name = re.sub(r'_[0-9]+$', '', str(farm_id))
-        farm_output_dir = os.path.join(output_dir, folder_name)
-        os.makedirs(farm_output_dir, exist_ok=True)
-        
         images_processed = 0
+        ext = ('.jpg' if jpeg else '.png') if save_as_png else '.tif'
         
-        # Process each temporal image for this farm
-        for date_tuple, tiff_path, date_name in temporal_files:
-            ext = '.png' if save_as_png else '.tif'
-            output_path = os.path.join(farm_output_dir, f"{date_name}{ext}")
+        with rasterio.open(tiff_path) as src:
+            # Farm polygons in the TIFF's CRS (shared by TIFFs with the same CRS)
+            farm_geoms = get_farm_geoms(farm_polygons, src.crs)
             
-            # Skip if already exists
-            if os.path.exists(output_path):
-                continue
-            
-            # Extract farm thumbnail
-            result_path = extract_farm_thumbnail(
-                tiff_path, farm_id, farm_polygon, output_path, save_as_png
-            )
-            
-            if result_path:
-                images_processed += 1
+            for farm_id, farm_geom in zip(farm_polygons, farm_geoms):
+                # Some input CSVs append a suffix like `_1` or `_2` to farm_id (from plot numbers).
+                # For folder names we want the canonical farm id only (strip trailing _<number>).
+                folder_name = re.sub(r'_[0-9]+$', '', str(farm_id))
+                farm_output_dir = os.path.join(output_dir, folder_name)
+                output_path = os.path.join(farm_output_dir, f"{date_name}{ext}")
+                
+                # Skip if already exists
+                if os.path.exists(output_path):
+                    continue
+                
+                os.makedirs(farm_output_dir, exist_ok=True)
+                
+                # Extract farm thumbnail
+                result_path = extract_farm_thumbnail(
+                    src, farm_id, farm_geom, output_path, save_as_png, jpeg=jpeg
+                )
+                
+                if result_path:
+                    images_processed += 1
         
-        update_progress()
-        return f"Farm {farm_id}: {images_processed} images processed"
+        return f"{date_name}: {images_processed} farm images extracted"
         
     except Exception as e:
-        update_progress()
-        return f"Farm {farm_id}: ERROR - {e}"
+        return f"{date_name}: ERROR - {e}"
 
-def create_enhanced_dataset(imgs_24_25_dir, plant_csv_file, output_dir, save_as_png=True, max_workers=4):
+def create_enhanced_dataset(imgs_24_25_dir, plant_csv_file, output_dir, save_as_png=True, max_workers=4, jpeg=False):
     """
     Create enhanced dataset by extracting farm thumbnails from temporal big TIFF files
     """
-    global total_farms, completed_farms
+    global total_files, completed_files
+    
+    farm_geoms_by_crs.clear()
     
     thread_safe_print("� Enhanced Farm Dataset Creator v2.0")
     thread_safe_print("=" * 60)
     thread_safe_print(f"📁 Source images: {imgs_24_25_dir}")
     thread_safe_print(f"� Farm coordinates: {plant_csv_file}")
     thread_safe_print(f"📤 Output directory: {output_dir}")
-    thread_safe_print(f"🖼️  Output format: {'PNG' if save_as_png else 'TIFF'}")
+    output_format = ('JPEG' if jpeg else 'PNG') if save_as_png else 'TIFF'
+    thread_safe_print(f"🖼️  Output format: {output_format}")
     thread_safe_print(f"🧵 Workers: {max_workers}")
     
     # Create output directory
@@ -405,40 +361,44 @@ def create_enhanced_dataset(imgs_24_25_dir, plant_csv_file, output_dir, save_as_
         thread_safe_print(f"  ... and {len(temporal_files) - 5} more")
     
     # Prepare arguments for parallel processing
-    total_farms = len(farm_polygons)
-    completed_farms = 0
+    total_files = len(temporal_files)
+    completed_files = 0
     
-    thread_safe_print(f"\n🏠 Processing {total_farms} farms with {len(temporal_files)} temporal images each...")
+    thread_safe_print(f"\n🏠 Processing {len(farm_polygons)} farms with {len(temporal_files)} temporal images each...")
     
-    farm_args = []
-    for farm_id, farm_polygon in farm_polygons.items():
-        farm_args.append((farm_id, farm_polygon, temporal_files, output_dir, save_as_png))
+    # One task per TIFF: each big image is opened once and every farm is cut
+    # out of it, instead of reopening it for every farm
+    tiff_args = []
+    for date_tuple, tiff_path, date_name in temporal_files:
+        tiff_args.append((date_name, tiff_path, output_dir, save_as_png, jpeg))
     
-    # Process farms in parallel
+    # Process TIFFs in parallel worker processes (stretching, resampling and
+    # PNG encoding hold the GIL); the polygons are sent once per worker
     start_time = time.time()
     results = []
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_farm = {executor.submit(process_single_farm_temporal, args): args[0] 
-                         for args in farm_args}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                             initargs=(farm_polygons, worker_gdal_threads(max_workers))) as executor:
+        future_to_tiff = {executor.submit(process_single_tiff_temporal, args): args[1]
+                          for args in tiff_args}
         
-        for future in as_completed(future_to_farm):
-            farm_id = future_to_farm[future]
+        for future in as_completed(future_to_tiff):
+            tiff_path = future_to_tiff[future]
             try:
                 result = future.result()
                 results.append(result)
             except Exception as e:
-                thread_safe_print(f"❌ Farm {farm_id} failed: {e}")
-                update_progress()
+                thread_safe_print(f"❌ {tiff_path} failed: {e}")
+            update_progress()
     
     end_time = time.time()
     
     thread_safe_print(f"\n✅ Enhanced dataset creation completed!")
     thread_safe_print(f"⏱️  Total time: {end_time - start_time:.2f} seconds")
     thread_safe_print(f"📁 Output: {output_dir}")
-    thread_safe_print(f"🏠 Farms processed: {total_farms}")
+    thread_safe_print(f"🏠 Farms processed: {len(farm_polygons)}")
     thread_safe_print(f"📷 Images per farm: {len(temporal_files)}")
-    thread_safe_print(f"🖼️  Format: {'PNG (optimized for web)' if save_as_png else 'TIFF (original quality)'}")
+    thread_safe_print(f"🖼️  Format: {output_format + ' (optimized for web)' if save_as_png else 'TIFF (original quality)'}")
     
     # Show some results
     if results:
@@ -463,9 +423,10 @@ def main():
     parser.add_argument('--input', '-i', default=default_csv, help='Path to farm CSV (default: 40k.csv in project root)')
     parser.add_argument('--imgs', '-m', default=default_imgs, help='Path to imgs_24_25 directory')
     parser.add_argument('--output', '-o', default=default_out, help='Output directory for enhanced dataset')
-    parser.add_argument('--workers', '-w', type=int, default=4, help='Number of worker threads')
+    parser.add_argument('--workers', '-w', type=int, default=4, help='Number of worker processes')
     parser.add_argument('--png', action='store_true', help='Save as PNG (default behavior)')
     parser.add_argument('--no-png', dest='png', action='store_false', help='Save as TIFF instead')
+    parser.add_argument('--jpeg', action='store_true', help='Save RGB thumbnails as JPEG instead of PNG')
     parser.set_defaults(png=True)
 
     args = parser.parse_args()
@@ -492,7 +453,7 @@ def main():
     print("   1. Load farm coordinates from the provided CSV")
     print("   2. Find all temporal TIFF files in imgs_24_25/")
     print("   3. Extract farm thumbnails for each date")
-    print("   4. Save as optimized PNG images (unless --no-png is used)")
+    print("   4. Save as optimized PNG images (JPEG with --jpeg, TIFF with --no-png)")
     print("   5. Organize by farm ID with date-labeled files")
 
     create_enhanced_dataset(
@@ -500,7 +461,8 @@ def main():
         plant_csv_file=plant_csv_file,
         output_dir=output_dir,
         save_as_png=args.png,  # Save as PNG for web optimization by default
-        max_workers=args.workers
+        max_workers=args.workers,
+        jpeg=args.jpeg
     )
 
 if __name__ == "__main__":
@@ -1,21 +1,22 @@
 #!/usr/bin/env python3
 """
-Fast Multi-threaded PNG Dataset Creator
-Converts TIF images to PNG with 10-core parallel processing for efficiency
+Fast Multi-process PNG Dataset Creator
+Converts TIF images to PNG with one worker process per core for efficiency
 """
 
 import os
-import rasterio
-import numpy as np
-from PIL import Image
-from datetime import datetime
-import re
-from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from threading import Lock
 import time
 
-# Global variables for thread safety
+from png_pipeline import (
+    convert_tif_to_png, find_all_temporal_images, get_temporal_images_from_imgs_24_25,
+    init_gdal_worker, worker_gdal_threads
+)
+
+# Progress is tracked in the parent process as worker results arrive
 print_lock = Lock()
 progress_lock = Lock()
 completed_farms = 0
@@ -34,147 +35,29 @@ def update_progress():
         if completed_farms % 10 == 0 or completed_farms == total_farms:
             thread_safe_print(f"✅ Progress: {completed_farms}/{total_farms} farms completed ({completed_farms/total_farms*100:.1f}%)")
 
-def aggressive_stretch(rgb_array, percentile_range=(0.5, 99.5)):
-    """Apply aggressive contrast stretching for better visualization"""
-    result = np.zeros_like(rgb_array, dtype=np.float64)
-    for i in range(3):
-        band = rgb_array[:, :, i].astype(np.float64)
-        non_zero = band[band > 0]
-        if len(non_zero) > 0:
-            p_low, p_high = np.percentile(non_zero, percentile_range)
-        else:
-            p_low, p_high = np.percentile(band, percentile_range)
-        if p_high > p_low:
-            result[:, :, i] = (band - p_low) / (p_high - p_low)
-        else:
-            result[:, :, i] = band / np.max(band) if np.max(band) > 0 else band
-    return np.clip(result * 255, 0, 255).astype(np.uint8)
+def link_or_copy(src, dst):
+    """Hardlink `src` to `dst` (replacing it), copying when linking is not possible"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
-def convert_tif_to_png(tif_path, png_path, size=(500, 500)):
-    """Convert TIF to PNG with RGB band mapping and aggressive stretching"""
+def is_up_to_date(output_path, source_path):
+    """True if `output_path` exists, is non-empty and is not older than `source_path`"""
     try:
-        with rasterio.open(tif_path) as src:
-            bands = src.read()
-            
-            if bands.shape[0] >= 4:
-                # RGB mapping: R=Band4, G=Band3, B=Band2
-                rgb_composite = np.stack([bands[3], bands[2], bands[1]], axis=-1)
-                
-                # Handle invalid values
-                if np.any(np.isnan(rgb_composite)) or np.any(np.isinf(rgb_composite)):
-                    rgb_composite = np.nan_to_num(rgb_composite, nan=0.0, posinf=0.0, neginf=0.0)
-                
-                # Apply aggressive contrast stretching
-                rgb_composite = aggressive_stretch(rgb_composite)
-                
-                # Create PIL image and resize
-                img = Image.fromarray(rgb_composite)
-                img = img.resize(size, Image.Resampling.LANCZOS)
-                
-                # Save as PNG
-                img.save(png_path, format='PNG', optimize=True)
-                return True
-            else:
-                return False
-                
-    except Exception as e:
-        thread_safe_print(f"❌ Error converting {tif_path}: {e}")
+        output_stat = os.stat(output_path)
+    except OSError:
         return False
-
-def parse_date_from_path_and_filename(folder_path, filename):
-    """Enhanced date parsing from both folder structure and filename"""
-    parts = Path(folder_path).parts
-    
-    # Method 1: Parse from folder structure (e.g., imgs_24_25/Oct/11Oct/)
-    month_name = None
-    day_month = None
-    
-    for part in parts:
-        if part in ['Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'March', 'April']:
-            month_name = part
-        elif any(part.endswith(month) for month in ['Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'March', 'April']):
-            day_month = part
-    
-    if month_name and day_month:
-        day_match = re.match(r'(\d+)', day_month)
-        if day_match:
-            day = int(day_match.group(1))
-            month_map = {
-                'Oct': 10, 'Nov': 11, 'Dec': 12,
-                'Jan': 1, 'Feb': 2, 'March': 3, 'April': 4
-            }
-            month = month_map.get(month_name)
-            if month:
-                year = 2024 if month >= 10 else 2025
-                return (year, month, day)
-    
-    # Method 2: Parse from filename (fallback)
-    filename_lower = filename.lower()
-    month_map = {
-        'jan': 1, 'january': 1, 'feb': 2, 'february': 2,
-        'mar': 3, 'march': 3, 'apr': 4, 'april': 4,
-        'may': 5, 'jun': 6, 'june': 6, 'jul': 7, 'july': 7,
-        'aug': 8, 'august': 8, 'sep': 9, 'sept': 9, 'september': 9,
-        'oct': 10, 'october': 10, 'nov': 11, 'november': 11,
-        'dec': 12, 'december': 12
-    }
-    
-    patterns = [
-        r'([a-z]+)_(\d{4})',
-        r'(\d+)([a-z]+),(\d{4})',
-        r'(\d+)([a-z]+)(\d{4})',
-        r'([a-z]+)(\d+)_(\d{4})',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, filename_lower)
-        if match:
-            groups = match.groups()
-            if len(groups) == 2:
-                month_str, year_str = groups
-                if month_str in month_map:
-                    return (int(year_str), month_map[month_str], 1)
-            elif len(groups) == 3:
-                if groups[0].isdigit():
-                    day_str, month_str, year_str = groups
-                    if month_str in month_map:
-                        return (int(year_str), month_map[month_str], int(day_str))
-                else:
-                    month_str, day_str, year_str = groups
-                    if month_str in month_map:
-                        return (int(year_str), month_map[month_str], int(day_str))
-    
-    # Default fallback
-    return (2024, 1, 1)
-
-def find_all_temporal_images(imgs_24_25_dir):
-    """Find all temporal images in imgs_24_25 directory"""
-    temporal_images = []
-    
-    for root, dirs, files in os.walk(imgs_24_25_dir):
-        for file in files:
-            if file.lower().endswith('.tif') and not file.endswith('_udm2.tif'):
-                file_path = os.path.join(root, file)
-                date_tuple = parse_date_from_path_and_filename(root, file)
-                
-                if date_tuple:
-                    year, month, day = date_tuple
-                    # Create standardized filename
-                    png_name = f"{year:04d}_{month:02d}_{day:02d}.png"
-                    temporal_images.append((date_tuple, file_path, png_name))
-    
-    # Sort by date and remove duplicates
-    temporal_images.sort(key=lambda x: x[0])
-    unique_images = {}
-    for date_tuple, file_path, png_name in temporal_images:
-        if png_name not in unique_images:
-            unique_images[png_name] = (date_tuple, file_path, png_name)
-    
-    return list(unique_images.values())
+    return output_stat.st_size > 0 and output_stat.st_mtime >= os.stat(source_path).st_mtime
 
 def process_single_farm(args):
-    """Process a single farm - convert all TIF images to PNG"""
-    farm_id, farm_input_dir, farm_output_dir, temporal_images = args
+    """
+    Process a single farm - link the shared temporal PNGs into the farm's
+    output directory (its legacy TIF images are converted as separate tasks)
+    """
+    farm_id, farm_output_dir, temporal_pngs = args
     
     try:
         # Create output directory
@@ -182,36 +65,45 @@ def process_single_farm(args):
         
         images_processed = 0
         
-        # Process temporal images
-        for date_tuple, file_path, png_name in temporal_images:
-            png_output_path = os.path.join(farm_output_dir, png_name)
-            if convert_tif_to_png(file_path, png_output_path):
-                images_processed += 1
-        
-        # Process existing farm images (legacy)
-        if os.path.exists(farm_input_dir):
-            for file in os.listdir(farm_input_dir):
-                if file.lower().endswith(('.tif', '.tiff')):
-                    tif_path = os.path.join(farm_input_dir, file)
-                    png_name = f"legacy_{os.path.splitext(file)[0]}.png"
-                    png_output_path = os.path.join(farm_output_dir, png_name)
-                    if convert_tif_to_png(tif_path, png_output_path):
-                        images_processed += 1
+        # Temporal images are the same for every farm: they were converted
+        # once, so each farm just gets a hardlink
+        for png_name, shared_png_path in temporal_pngs:
+            link_or_copy(shared_png_path, os.path.join(farm_output_dir, png_name))
+            images_processed += 1
         
-        update_progress()
-        return f"Farm {farm_id}: {images_processed} images converted"
+        return f"Farm {farm_id}: {images_processed} images linked"
         
     except Exception as e:
-        update_progress()
         return f"Farm {farm_id}: ERROR - {e}"
 
-def create_png_dataset_parallel(imgs_24_25_dir, current_farm_dataset_dir, output_dir, max_workers=10):
-    """Create PNG dataset using parallel processing"""
+def find_legacy_conversions(farm_input_dir, farm_output_dir):
+    """(tif_path, png_path) pairs for the farm's own TIF images that need converting"""
+    conversions = []
+    if os.path.exists(farm_input_dir):
+        for file in os.listdir(farm_input_dir):
+            if file.lower().endswith(('.tif', '.tiff')):
+                tif_path = os.path.join(farm_input_dir, file)
+                png_name = f"legacy_{os.path.splitext(file)[0]}.png"
+                png_output_path = os.path.join(farm_output_dir, png_name)
+                
+                # Skip outputs left by a previous run
+                if not is_up_to_date(png_output_path, tif_path):
+                    conversions.append((tif_path, png_output_path))
+    return conversions
+
+def create_png_dataset_parallel(imgs_24_25_dir, current_farm_dataset_dir, output_dir, max_workers=None):
+    """
+    Create PNG dataset using parallel processing.
+    Farms are converted in separate processes (default: one per CPU core), since
+    the stretch, resize and PNG encode hold the GIL.
+    """
     global total_farms, completed_farms
     
-    thread_safe_print("🚀 Fast Multi-threaded PNG Dataset Creator")
+    max_workers = max_workers or os.cpu_count() or 1
+    
+    thread_safe_print("🚀 Fast Multi-process PNG Dataset Creator")
     thread_safe_print("=" * 50)
-    thread_safe_print(f"🧵 Using {max_workers} parallel threads")
+    thread_safe_print(f"🧵 Using {max_workers} worker processes")
     thread_safe_print(f"📁 Source images: {imgs_24_25_dir}")
     thread_safe_print(f"📂 Current farms: {current_farm_dataset_dir}")
     thread_safe_print(f"📤 Output directory: {output_dir}")
@@ -235,30 +127,72 @@ def create_png_dataset_parallel(imgs_24_25_dir, current_farm_dataset_dir, output
     total_farms = len(existing_farms)
     completed_farms = 0
     
-    thread_safe_print(f"🏠 Processing {total_farms} farms in parallel...")
-    
-    # Prepare arguments for parallel processing
-    farm_args = []
-    for farm_id in existing_farms:
-        farm_input_dir = os.path.join(current_farm_dataset_dir, farm_id)
-        farm_output_dir = os.path.join(output_dir, farm_id)
-        farm_args.append((farm_id, farm_input_dir, farm_output_dir, temporal_images))
+    # Skip temporal images every farm already has from a previous run
+    farm_output_dirs = [os.path.join(output_dir, farm_id) for farm_id in existing_farms]
+    pending_images = [
+        (date_tuple, file_path, png_name) for date_tuple, file_path, png_name in temporal_images
+        if not all(is_up_to_date(os.path.join(d, png_name), file_path) for d in farm_output_dirs)
+    ]
+    if len(pending_images) < len(temporal_images):
+        thread_safe_print(f"⏭️  Skipping {len(temporal_images) - len(pending_images)} temporal images already converted")
     
     # Process farms in parallel
     start_time = time.time()
     results = []
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_farm = {executor.submit(process_single_farm, args): args[0] for args in farm_args}
+    # Temporal images are converted once into a scratch directory inside the
+    # output (same filesystem, so farms can hardlink them); it is removed
+    # afterwards, the farm links keep the files
+    shared_png_dir = tempfile.mkdtemp(prefix='.temporal_png_', dir=output_dir)
+    try:
+        # Every conversion is an independent task: the pending temporal images
+        # plus each farm's legacy TIFs, so all cores stay busy however the work
+        # is spread over farms
+        conversions = [(file_path, os.path.join(shared_png_dir, png_name))
+                       for date_tuple, file_path, png_name in pending_images]
+        num_temporal = len(conversions)
+        for farm_id, farm_output_dir in zip(existing_farms, farm_output_dirs):
+            os.makedirs(farm_output_dir, exist_ok=True)
+            conversions.extend(find_legacy_conversions(
+                os.path.join(current_farm_dataset_dir, farm_id), farm_output_dir))
         
-        for future in as_completed(future_to_farm):
-            farm_id = future_to_farm[future]
-            try:
-                result = future.result()
-                results.append(result)
-            except Exception as e:
-                thread_safe_print(f"❌ Farm {farm_id} failed: {e}")
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_gdal_worker,
+                                 initargs=(worker_gdal_threads(max_workers),)) as executor:
+            thread_safe_print(f"🖼️  Converting {num_temporal} temporal and "
+                              f"{len(conversions) - num_temporal} legacy images...")
+            
+            # Small chunks amortize the task round trips without starving workers
+            chunksize = max(1, min(4, len(conversions) // (4 * max_workers)))
+            converted = list(executor.map(convert_tif_to_png,
+                                          [src for src, _ in conversions],
+                                          [dst for _, dst in conversions],
+                                          chunksize=chunksize))
+            
+            temporal_pngs = sorted(
+                (os.path.basename(dst), dst)
+                for (_, dst), ok in zip(conversions[:num_temporal], converted[:num_temporal]) if ok
+            )
+            legacy_converted = sum(converted[num_temporal:])
+            
+            thread_safe_print(f"🏠 Processing {total_farms} farms in parallel...")
+            
+            # Prepare arguments for parallel processing
+            farm_args = [(farm_id, farm_output_dir, temporal_pngs)
+                         for farm_id, farm_output_dir in zip(existing_farms, farm_output_dirs)]
+            
+            future_to_farm = {executor.submit(process_single_farm, args): args[0] for args in farm_args}
+            
+            for future in as_completed(future_to_farm):
+                farm_id = future_to_farm[future]
+                try:
+                    result = future.result()
+                    results.append(result)
+                except Exception as e:
+                    thread_safe_print(f"❌ Farm {farm_id} failed: {e}")
                 update_progress()
+    finally:
+        # Also on errors and Ctrl-C, or the scratch directory would be listed as a farm
+        shutil.rmtree(shared_png_dir, ignore_errors=True)
     
     end_time = time.time()
     
@@ -266,7 +200,7 @@ def create_png_dataset_parallel(imgs_24_25_dir, current_farm_dataset_dir, output
     thread_safe_print(f"⏱️  Total time: {end_time - start_time:.2f} seconds")
     thread_safe_print(f"📁 Output: {output_dir}")
     thread_safe_print(f"🏠 Farms processed: {total_farms}")
-    thread_safe_print(f"📷 Images per farm: {len(temporal_images)} + legacy images")
+    thread_safe_print(f"📷 Images per farm: {len(temporal_images)} + legacy images ({legacy_converted} converted)")
     thread_safe_print(f"🖼️  Format: PNG (optimized for web)")
 
 def main():
@@ -287,141 +221,12 @@ def main():
         print(f"❌ farm_dataset directory not found: {current_farm_dataset_dir}")
         return
     
-    # Create PNG dataset with parallel processing
-    create_png_dataset_parallel(imgs_24_25_dir, current_farm_dataset_dir, output_dir, max_workers=10)
+    # Create PNG dataset with parallel processing (one worker per core)
+    create_png_dataset_parallel(imgs_24_25_dir, current_farm_dataset_dir, output_dir)
 
 if __name__ == "__main__":
     main()
 
-import os
-import numpy as np
-import rasterio
-from PIL import Image
-from datetime import datetime
-import re
-from pathlib import Path
-
-def aggressive_stretch(rgb_array, percentile_range=(0.5, 99.5)):
-    """
-    Apply aggressive contrast stretching to RGB array
-    Same function as used in the Flask app
-    """
-    result = np.zeros_like(rgb_array, dtype=np.float64)
-    for i in range(3):
-        band = rgb_array[:, :, i].astype(np.float64)
-        non_zero = band[band > 0]
-        if len(non_zero) > 0:
-            p_low, p_high = np.percentile(non_zero, percentile_range)
-        else:
-            p_low, p_high = np.percentile(band, percentile_range)
-        if p_high > p_low:
-            result[:, :, i] = (band - p_low) / (p_high - p_low)
-        else:
-            result[:, :, i] = band / np.max(band) if np.max(band) > 0 else band
-    return np.clip(result * 255, 0, 255).astype(np.uint8)
-
-def process_tiff_to_png(tiff_path, output_path, target_size=(800, 800)):
-    """
-    Convert TIFF to PNG with enhanced contrast and proper RGB bands
-    """
-    try:
-        with rasterio.open(tiff_path) as src:
-            bands = src.read()
-            
-            if bands.shape[0] >= 4:
-                # Create RGB image with R=Band4, G=Band3, B=Band2
-                rgb_composite = np.stack([bands[3], bands[2], bands[1]], axis=-1)
-                
-                # Handle invalid values
-                if np.any(np.isnan(rgb_composite)) or np.any(np.isinf(rgb_composite)):
-                    rgb_composite = np.nan_to_num(rgb_composite, nan=0.0, posinf=0.0, neginf=0.0)
-                
-                # Apply aggressive contrast stretching
-                rgb_enhanced = aggressive_stretch(rgb_composite)
-                
-                # Create PIL image and resize
-                img = Image.fromarray(rgb_enhanced)
-                img = img.resize(target_size, Image.Resampling.LANCZOS)
-                
-                # Save as PNG with optimization
-                img.save(output_path, 'PNG', optimize=True, compress_level=6)
-                return True
-            else:
-                print(f"⚠️  Insufficient bands: {tiff_path}")
-                return False
-                
-    except Exception as e:
-        print(f"❌ Error processing {tiff_path}: {e}")
-        return False
-
-def parse_date_from_path(folder_path):
-    """
-    Parse date from imgs_24_25 folder structure
-    Format: imgs_24_25/Month/DayMonth/
-    """
-    parts = Path(folder_path).parts
-    
-    month_name = None
-    day_month = None
-    
-    for part in parts:
-        if part in ['Oct', 'Nov', 'Dec', 'Jan', 'Feb', 'March', 'April']:
-            month_name = part
-        elif re.match(r'\d+\w+', part):  # Pattern like "11Oct", "28Nov", etc.
-            day_month = part
-    
-    if not month_name or not day_month:
-        return None
-    
-    # Extract day from day_month (e.g., "11Oct" -> 11)
-    day_match = re.match(r'(\d+)', day_month)
-    if not day_match:
-        return None
-    
-    day = int(day_match.group(1))
-    
-    # Month mapping
-    month_map = {
-        'Oct': 10, 'Nov': 11, 'Dec': 12,
-        'Jan': 1, 'Feb': 2, 'March': 3, 'April': 4
-    }
-    
-    month = month_map.get(month_name)
-    if not month:
-        return None
-    
-    # Determine year based on month
-    if month >= 10:  # Oct, Nov, Dec
-        year = 2024
-    else:  # Jan, Feb, March, April
-        year = 2025
-    
-    return (year, month, day)
-
-def get_temporal_images_from_imgs_24_25(imgs_24_25_dir):
-    """
-    Scan imgs_24_25 directory and get all temporal images
-    """
-    temporal_images = []
-    
-    for root, dirs, files in os.walk(imgs_24_25_dir):
-        for file in files:
-            if file.endswith('.tif') and not file.endswith('_udm2.tif'):
-                file_path = os.path.join(root, file)
-                
-                # Parse date from folder path
-                date_tuple = parse_date_from_path(root)
-                
-                if date_tuple:
-                    year, month, day = date_tuple
-                    
-                    # Create consistent naming: YYYY_MM_DD.png
-                    png_name = f"{year:04d}_{month:02d}_{day:02d}.png"
-                    
-                    temporal_images.append((date_tuple, file_path, png_name))
-    
-    return temporal_images
-
 def create_png_dataset_from_temporal(imgs_24_25_dir, output_dir, limit_farms=None):
     """
     Create PNG dataset from imgs_24_25 temporal images with proper naming
@@ -492,7 +297,7 @@ def create_png_dataset_from_temporal(imgs_24_25_dir, output_dir, limit_farms=Non
                 print(f"  ✅ Exists: {png_name}")
                 continue
             
-            if process_tiff_to_png(tif_path, png_output_path):
+            if convert_tif_to_png(tif_path, png_output_path, size=(800, 800)):
                 print(f"  🔄 Converted: {png_name}")
                 farm_converted += 1
                 total_converted += 1
@@ -577,7 +382,7 @@ def create_png_dataset_from_existing(source_dir, output_dir, limit_farms=None):
                 continue
             
             # Process TIFF to PNG
-            if process_tiff_to_png(tiff_path, png_path):
+            if convert_tif_to_png(tiff_path, png_path, size=(800, 800)):
                 print(f"    🔄 Converted: {png_filename}")
                 total_images += 1
             else:
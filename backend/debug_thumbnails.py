@@ -1,20 +1,22 @@
 #!/usr/bin/env python3
 """
-Debug script to visualize generated thumbnails using matplotlib
+Debug script to visualize generated thumbnails as a labelled contact sheet
 """
 
 import os
-import sys
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
+import argparse
 from image_utils import ImageProcessor
 import base64
 from io import BytesIO
-from PIL import Image
-import numpy as np
+from PIL import Image, ImageDraw
 
-def debug_thumbnails():
-    """Generate and display thumbnails for debugging"""
+# Contact sheet layout: 2 rows x 3 columns of thumbnails with a caption strip
+GRID_ROWS, GRID_COLS = 2, 3
+TILE_SIZE = 500
+CAPTION_HEIGHT = 30
+
+def debug_thumbnails(show=False):
+    """Generate thumbnails for debugging and save them as one grid image"""
     
     # Setup paths
     app_dir = os.path.dirname(os.path.abspath(__file__))
@@ -64,23 +66,28 @@ def debug_thumbnails():
     print(f"📷 Found {len(tiff_files)} TIFF files")
     
     # Process first few images (max 6 for display)
-    max_images = min(6, len(tiff_files))
-    fig, axes = plt.subplots(2, 3, figsize=(15, 10))
-    fig.suptitle(f'Thumbnail Debug - Farm {farm_id}', fontsize=16)
+    max_images = min(GRID_ROWS * GRID_COLS, len(tiff_files))
+    cell_height = TILE_SIZE + CAPTION_HEIGHT
+    grid = Image.new('RGB', (GRID_COLS * TILE_SIZE, CAPTION_HEIGHT + GRID_ROWS * cell_height), 'white')
+    draw = ImageDraw.Draw(grid)
+    draw.text((10, 8), f'Thumbnail Debug - Farm {farm_id}', fill='black')
     
-    # Flatten axes for easier indexing
-    axes = axes.flatten()
+    # Generate the thumbnails as base64, in parallel
+    thumbnail_data_urls = image_processor.generate_thumbnails_batch(tiff_files[:max_images])
     
     for i in range(max_images):
         img_path = tiff_files[i]
         filename = os.path.basename(img_path)
         
+        # Top-left corner of this image's cell (caption strip, then tile)
+        x = (i % GRID_COLS) * TILE_SIZE
+        y = CAPTION_HEIGHT + (i // GRID_COLS) * cell_height
+        
         print(f"\n🖼️  Processing: {filename}")
         print(f"   Full path: {img_path}")
         
         try:
-            # Generate thumbnail as base64
-            thumbnail_data_url = image_processor.generate_thumbnail_base64(img_path)
+            thumbnail_data_url = thumbnail_data_urls[i]
             
             # Extract base64 data
             if thumbnail_data_url.startswith('data:image/png;base64,'):
@@ -89,43 +96,33 @@ def debug_thumbnails():
                 # Decode base64 to image
                 image_data = base64.b64decode(base64_data)
                 image = Image.open(BytesIO(image_data))
+                image.load()
                 
-                # Convert to numpy array for matplotlib
-                img_array = np.array(image)
-                
-                # Display in subplot
-                axes[i].imshow(img_array)
-                axes[i].set_title(f'{filename}\n{img_array.shape}', fontsize=10)
-                axes[i].axis('off')
+                # Paste into the grid cell under its caption
+                draw.text((x + 10, y + 8), f'{filename} {image.size} {image.mode}', fill='black')
+                tile = image.convert('RGB')
+                tile.thumbnail((TILE_SIZE, TILE_SIZE))
+                grid.paste(tile, (x, y + CAPTION_HEIGHT))
                 
-                print(f"   ✅ Success: {img_array.shape}")
+                print(f"   ✅ Success: {image.mode}")
                 print(f"   📏 Size: {image.size}")
                 
             else:
                 print(f"   ❌ Invalid data URL format")
-                axes[i].text(0.5, 0.5, 'Invalid\nData URL', 
-                           ha='center', va='center', transform=axes[i].transAxes)
-                axes[i].axis('off')
+                draw.text((x + 10, y + CAPTION_HEIGHT + TILE_SIZE // 2), 'Invalid Data URL', fill='red')
                 
         except Exception as e:
             print(f"   ❌ Error: {e}")
-            axes[i].text(0.5, 0.5, f'Error:\n{str(e)[:50]}...', 
-                        ha='center', va='center', transform=axes[i].transAxes)
-            axes[i].axis('off')
-    
-    # Hide unused subplots
-    for i in range(max_images, 6):
-        axes[i].axis('off')
-    
-    plt.tight_layout()
+            draw.text((x + 10, y + CAPTION_HEIGHT + TILE_SIZE // 2), f'Error: {str(e)[:50]}...', fill='red')
     
-    # Save debug plot
+    # Save debug grid
     debug_plot_path = os.path.join(app_dir, 'thumbnail_debug.png')
-    plt.savefig(debug_plot_path, dpi=150, bbox_inches='tight')
+    grid.save(debug_plot_path)
     print(f"\n💾 Debug plot saved: {debug_plot_path}")
     
-    # Show plot
-    plt.show()
+    # Open in the system image viewer only when asked (headless runs just save)
+    if show:
+        grid.show()
     
     print("\n📝 Debug Summary:")
     print(f"   🏠 Farm processed: {farm_id}")
@@ -134,4 +131,7 @@ def debug_thumbnails():
     print(f"   📏 Target size: 500x500 pixels")
 
 if __name__ == "__main__":
-    debug_thumbnails()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Render the first farm's thumbnails into thumbnail_debug.png")
+    parser.add_argument('--show', action='store_true', help='Open the result in an image viewer')
+    args = parser.parse_args()
+    debug_thumbnails(show=args.show)
\ No newline at end of file
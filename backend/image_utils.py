@@ -1,93 +1,134 @@
 import os
+import functools
 import hashlib
+import multiprocessing
 import re
+import shutil
+import threading
 from datetime import datetime
 from PIL import Image
 import rasterio
+from rasterio.enums import Resampling
 import numpy as np
 import io
-import base64
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterable, Optional
 
+from png_pipeline import GDAL_ENV_OPTIONS, aggressive_stretch, read_rgb_bands
 
-def parse_date_from_filename(filename_or_path: str) -> tuple:
-    """Parse date from a filename (or full path). Return a sortable tuple (year, month_num, day)."""
-    try:
-        filename = os.path.basename(filename_or_path)
-    except Exception:
-        filename = str(filename_or_path)
+try:
+    # Optional: libvips shrink-on-load thumbnails for plain PNG/JPEG sources
+    import pyvips
+except ImportError:
+    pyvips = None
+
+try:
+    # Optional: SIMD base64 encoding of ImageProcessor data URLs (same API)
+    import pybase64 as _b64
+except ImportError:
+    import base64 as _b64
+
+
+# Month name mapping
+_MONTH_MAP = {
+    'jan': 1, 'january': 1,
+    'feb': 2, 'february': 2,
+    'mar': 3, 'march': 3,
+    'apr': 4, 'april': 4,
+    'may': 5,
+    'jun': 6, 'june': 6,
+    'jul': 7, 'july': 7,
+    'aug': 8, 'august': 8,
+    'sep': 9, 'sept': 9, 'september': 9,
+    'oct': 10, 'october': 10,
+    'nov': 11, 'november': 11,
+    'dec': 12, 'december': 12
+}
+
+# New enhanced dataset format: YYYY_MM_DD.png (or .jpg with --jpeg)
+_ENHANCED_PATTERN = re.compile(r'^(\d{4})_(\d{1,2})_(\d{1,2})\.(?:png|jpe?g)$')
+
+# Legacy patterns, tried in order
+_LEGACY_PATTERNS = [re.compile(p) for p in (
+    r'([a-z]+)_(\d{4})_(\d+)',  # Month_Year_Day format (e.g., Dec_2024_05)
+    r'([a-z]+)_(\d{4})',
+    r'(\d+)([a-z]+),(\d{4})',
+    r'(\d+)([a-z]+)(\d{4})',
+    r'([a-z]+)(\d+)_(\d{4})',
+)]
+
+# Every legacy pattern only returns when it captures a month name, so names
+# without one can skip them entirely
+_MONTH_TOKEN = re.compile(r'jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec')
+
+_YEAR_PATTERN = re.compile(r'20\d{2}')
+
+
+@functools.lru_cache(maxsize=100_000)
+def _parse_date_from_name(filename: str) -> Optional[tuple]:
+    """Parse a date tuple from a bare filename, or None if no pattern matches."""
     filename_lower = filename.lower()
     
-    # Try the new enhanced dataset format: YYYY_MM_DD.png
-    enhanced_pattern = r'^(\d{4})_(\d{1,2})_(\d{1,2})\.png$'
-    match = re.search(enhanced_pattern, filename_lower)
+    match = _ENHANCED_PATTERN.search(filename_lower)
     if match:
         year = int(match.group(1))
         month = int(match.group(2))
         day = int(match.group(3))
         return (year, month, day)
     
-    # Month name mapping
-    month_map = {
-        'jan': 1, 'january': 1,
-        'feb': 2, 'february': 2,
-        'mar': 3, 'march': 3,
-        'apr': 4, 'april': 4,
-        'may': 5,
-        'jun': 6, 'june': 6,
-        'jul': 7, 'july': 7,
-        'aug': 8, 'august': 8,
-        'sep': 9, 'sept': 9, 'september': 9,
-        'oct': 10, 'october': 10,
-        'nov': 11, 'november': 11,
-        'dec': 12, 'december': 12
-    }
-    
-    # Try different legacy patterns
-    patterns = [
-        r'([a-z]+)_(\d{4})_(\d+)',  # Month_Year_Day format (e.g., Dec_2024_05)
-        r'([a-z]+)_(\d{4})',
-        r'(\d+)([a-z]+),(\d{4})',
-        r'(\d+)([a-z]+)(\d{4})',
-        r'([a-z]+)(\d+)_(\d{4})',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, filename_lower)
+    for pattern in (_LEGACY_PATTERNS if _MONTH_TOKEN.search(filename_lower) else ()):
+        match = pattern.search(filename_lower)
         if match:
             groups = match.groups()
             
             if len(groups) == 2:
                 month_str, year_str = groups
-                if month_str in month_map:
-                    return (int(year_str), month_map[month_str], 1)
+                if month_str in _MONTH_MAP:
+                    return (int(year_str), _MONTH_MAP[month_str], 1)
                     
             elif len(groups) == 3:
                 # Check if first group is month name
-                if groups[0] in month_map:
+                if groups[0] in _MONTH_MAP:
                     month_str = groups[0]
                     # Check if second group is year (4 digits)
                     if len(groups[1]) == 4:
                         # Pattern: Month_Year_Day
                         year_str = groups[1]
                         day_str = groups[2]
-                        return (int(year_str), month_map[month_str], int(day_str))
+                        return (int(year_str), _MONTH_MAP[month_str], int(day_str))
                     else:
                         # Pattern: Month_Day_Year
                         day_str = groups[1]
                         year_str = groups[2]
-                        return (int(year_str), month_map[month_str], int(day_str))
+                        return (int(year_str), _MONTH_MAP[month_str], int(day_str))
                 # Check if first group is digit (day)
                 elif groups[0].isdigit():
                     day_str, month_str, year_str = groups
-                    if month_str in month_map:
-                        return (int(year_str), month_map[month_str], int(day_str))
+                    if month_str in _MONTH_MAP:
+                        return (int(year_str), _MONTH_MAP[month_str], int(day_str))
     
     # Try to extract year at least
-    year_match = re.search(r'20\d{2}', filename)
+    year_match = _YEAR_PATTERN.search(filename)
     if year_match:
         year = int(year_match.group())
         return (year, 0, 0)
+    
+    return None
+
+
+def parse_date_from_filename(filename_or_path: str) -> tuple:
+    """Parse date from a filename (or full path). Return a sortable tuple (year, month_num, day)."""
+    try:
+        filename = os.path.basename(filename_or_path)
+    except Exception:
+        filename = str(filename_or_path)
+    
+    # Filename patterns are cached on the basename; only the mtime
+    # fallback below needs the full path
+    date_tuple = _parse_date_from_name(filename)
+    if date_tuple is not None:
+        return date_tuple
 
     # Last resort: use file modification time
     try:
@@ -101,78 +142,238 @@ def parse_date_from_filename(filename_or_path: str) -> tuple:
     return (2024, 0, 0)
 
 
-def make_thumbnail(source_path: str, width: int = 300, height: int = 300) -> Optional[str]:
+def _cachehash(s: str) -> str:
+    """Filename-safe cache key for `s` (not used for anything security-sensitive)."""
+    return hashlib.blake2b(s.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _robust_minmax(arr: np.ndarray, low: float = 2.0, high: float = 98.0) -> tuple:
+    """
+    Return the `low`/`high` percentiles of `arr` as stretch bounds.
+    For uint8/uint16 rasters they come from one bincount histogram pass
+    instead of sorting; other dtypes fall back to np.percentile on the
+    finite values.
+    """
+    if arr.dtype in (np.uint8, np.uint16):
+        hist = np.bincount(arr.ravel(), minlength=np.iinfo(arr.dtype).max + 1)
+        cdf = np.cumsum(hist)
+        total = cdf[-1]
+        lo = int(np.searchsorted(cdf, total * low / 100.0))
+        hi = int(np.searchsorted(cdf, total * high / 100.0))
+        return lo, hi
+
+    finite = arr[np.isfinite(arr)]
+    if finite.size == 0:
+        return 0.0, 0.0
+    lo, hi = np.percentile(finite, (low, high))
+    return float(lo), float(hi)
+
+
+def _normalize_to_uint8(arr: np.ndarray) -> np.ndarray:
+    """
+    Percentile-stretch an array of any numeric dtype to uint8.
+    Clipping at P2/P98 keeps a few saturated or nodata pixels from washing
+    out the whole thumbnail. uint16 input goes through a lookup table,
+    other dtypes through one float32 buffer scaled in place; uint8 input
+    is returned as-is.
+    """
+    if arr.dtype == np.uint8:
+        return arr
+    lo, hi = _robust_minmax(arr)
+    if not hi > lo:
+        return np.zeros(arr.shape, dtype=np.uint8)
+    if arr.dtype == np.uint16:
+        # 65536-entry lookup table: one gather pass, no float32 copy of the raster
+        lut = np.arange(65536, dtype=np.float32)
+        lut -= lo
+        lut *= 255.0 / (hi - lo)
+        np.clip(lut, 0, 255, out=lut)
+        return np.take(lut.astype(np.uint8), arr)
+    # Convert and subtract in one pass, into a C-ordered buffer even when
+    # `arr` is a channel-last view of band-major data
+    out = np.empty(arr.shape, dtype=np.float32)
+    np.subtract(arr, lo, out=out, casting='unsafe')
+    out *= 255.0 / (hi - lo)
+    np.nan_to_num(out, copy=False)
+    np.clip(out, 0, 255, out=out)
+    return out.astype(np.uint8)
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THUMB_CACHE_DIR = os.path.join(ROOT_DIR, 'thumbnail_cache')
+# ImageProcessor's data URL cache; kept out of THUMB_CACHE_DIR, which is
+# served publicly as /thumbcache
+DATA_URL_CACHE_DIR = os.path.join(ROOT_DIR, 'thumbnail_data_urls')
+
+# Names of the thumbnails known to exist in THUMB_CACHE_DIR, filled by one
+# scan on first use and kept current as thumbnails are written
+_THUMB_INDEX: Optional[set] = None
+
+
+def _thumb_index() -> set:
+    """Return the in-memory index of cached thumbnail names"""
+    global _THUMB_INDEX
+    if _THUMB_INDEX is None:
+        os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+        index = set()
+        with os.scandir(THUMB_CACHE_DIR) as shards:
+            for shard in shards:
+                if shard.is_dir():
+                    with os.scandir(shard.path) as entries:
+                        # Skip leftovers of interrupted writes
+                        index.update(e.name for e in entries if e.is_file() and '.tmp' not in e.name)
+        _THUMB_INDEX = index
+    return _THUMB_INDEX
+
+
+def thumb_path_for(source_path: str, width: int, height: int) -> Optional[str]:
+    """Deterministic cache path of the `width`x`height` thumbnail of `source_path`,
+    or None if the source can't be stat'ed.
+    The key includes the source's size and mtime, so a regenerated image gets a
+    new name (cached copies are served as immutable).
+    Thumbnails are sharded into 256 subdirectories by the first two hash digits.
+    Gallery previews are PNG; larger web views are stored as JPEG.
+    """
+    try:
+        st = os.stat(source_path)
+    except OSError:
+        return None
+    key = _cachehash(f"{source_path}:{st.st_size}:{st.st_mtime_ns}")
+    ext = 'png' if max(width, height) <= 300 else 'jpg'
+    return os.path.join(THUMB_CACHE_DIR, key[:2], f"{key}_{width}x{height}.{ext}")
+
+
+def _save_thumbnail(im: Image.Image, thumb_path: str):
+    """Encode a thumbnail in the format given by its cache path"""
+    if thumb_path.endswith('.jpg'):
+        im.save(thumb_path, format='JPEG', quality=85, progressive=True)
+    else:
+        # Cached thumbnails are cheap to rebuild; favour encode speed over size
+        im.save(thumb_path, format='PNG', optimize=False, compress_level=1)
+
+
+def make_thumbnail(source_path: str, width: int = 300, height: int = 300,
+                   resample: Optional[int] = None) -> Optional[str]:
     """
     Generate (and cache) a thumbnail for `source_path` with the requested size.
     Returns the filesystem path to the thumbnail image, or None on failure.
     Handles multispectral TIFF files using rasterio.
+    `resample` defaults to BILINEAR for small gallery previews and LANCZOS
+    for larger web views.
     """
-    ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    THUMB_CACHE_DIR = os.path.join(ROOT_DIR, 'thumbnail_cache')
-    os.makedirs(THUMB_CACHE_DIR, exist_ok=True)
+    thumb_path = thumb_path_for(source_path, width, height)
+    if thumb_path is None or not os.path.isfile(source_path):
+        return None
     
-    if not os.path.isfile(source_path):
+    thumb_name = os.path.basename(thumb_path)
+    index = _thumb_index()
+    if thumb_name in index:
+        if os.path.isfile(thumb_path):
+            return thumb_path
+        # Removed while the server was running (e.g. clear_thumbnails.py)
+        index.discard(thumb_name)
+    
+    if resample is None:
+        resample = Image.Resampling.BILINEAR if max(width, height) <= 300 else Image.Resampling.LANCZOS
+    
+    # Render to a temporary name and rename into place, so readers never see
+    # a half-written thumbnail (the suffix is kept for format detection)
+    os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+    base, ext = os.path.splitext(thumb_path)
+    tmp_path = f"{base}.tmp{os.getpid()}-{threading.get_ident()}{ext}"
+    result = _render_thumbnail(source_path, tmp_path, width, height, resample)
+    if result is None:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
         return None
+    
+    os.replace(tmp_path, thumb_path)
+    index.add(thumb_name)
+    return thumb_path
+
 
-    # Deterministic cache name that includes size
-    base_h = hashlib.sha256(source_path.encode('utf-8')).hexdigest()
-    thumb_name = f"{base_h}_{width}x{height}.png"
-    thumb_path = os.path.join(THUMB_CACHE_DIR, thumb_name)
+def pregenerate_thumbnails(source_paths: Iterable[str], width: int = 300, height: int = 300,
+                           max_workers: Optional[int] = None,
+                           stop: Optional[threading.Event] = None) -> int:
+    """
+    Build the missing `width`x`height` thumbnails for `source_paths` across a
+    process pool. Returns the number of thumbnails generated.
+    Setting `stop` cancels the thumbnails not yet started.
+    """
+    index = _thumb_index()
+    missing = []
+    for p in source_paths:
+        thumb_path = thumb_path_for(p, width, height)
+        if thumb_path is not None and os.path.basename(thumb_path) not in index:
+            missing.append(p)
+    if not missing:
+        return 0
+    
+    max_workers = max_workers or os.cpu_count() or 1
+    chunksize = max(1, len(missing) // (max_workers * 4))
+    generated = 0
+    # Spawned, not forked: this runs inside the server, where other threads
+    # (request workers mid GDAL read, the event loop) may hold locks that a
+    # forked child would inherit in the locked state
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = executor.map(make_thumbnail, missing, repeat(width), repeat(height),
+                               chunksize=chunksize)
+        for thumb_path in results:
+            if stop is not None and stop.is_set():
+                executor.shutdown(wait=True, cancel_futures=True)
+                break
+            # Workers have their own index; record their output in ours
+            if thumb_path is not None:
+                index.add(os.path.basename(thumb_path))
+                generated += 1
+    return generated
 
-    if os.path.isfile(thumb_path):
-        return thumb_path
 
+def _render_thumbnail(source_path: str, thumb_path: str, width: int, height: int,
+                      resample: int) -> Optional[str]:
+    """Decode `source_path` and write its thumbnail to `thumb_path`"""
     try:
         # Check if it's a TIFF file that might need special handling
         if source_path.lower().endswith(('.tif', '.tiff')):
             # First, try using rasterio for multispectral/complex TIFFs
             try:
                 with rasterio.open(source_path) as src:
-                    # Read the data
-                    data = src.read()
+                    # Pick the bands to display: 4+ bands -> bands 3,2,1 as RGB,
+                    # 3 bands -> assume RGB, 1 band -> grayscale
+                    if src.count >= 4:
+                        indexes = [3, 2, 1]
+                    elif src.count == 3:
+                        indexes = [1, 2, 3]
+                    elif src.count == 1:
+                        indexes = [1]
+                    else:
+                        raise ValueError(f"Unsupported band count: {src.count}")
                     
-                    # Handle different band counts
-                    if data.shape[0] >= 3:
-                        # Multi-band: Use first 3 bands as RGB
-                        if data.shape[0] >= 4:
-                            # For 4+ bands, try to pick RGB-like bands
-                            rgb = np.stack([
-                                data[2, :, :],  # Red
-                                data[1, :, :],  # Green
-                                data[0, :, :]   # Blue
-                            ], axis=-1)
-                        else:
-                            # 3 bands: assume RGB
-                            rgb = np.stack([
-                                data[0, :, :],
-                                data[1, :, :],
-                                data[2, :, :]
-                            ], axis=-1)
-                    elif data.shape[0] == 1:
+                    # Decimated read close to the target size; GDAL uses the
+                    # internal overviews when present instead of decoding the
+                    # full-resolution raster
+                    scale = max(src.width / width, src.height / height, 1.0)
+                    out_h = max(1, int(src.height / scale))
+                    out_w = max(1, int(src.width / scale))
+                    data = src.read(
+                        indexes=indexes,
+                        out_shape=(len(indexes), out_h, out_w),
+                        resampling=Resampling.average
+                    )
+                    
+                    if data.shape[0] == 3:
+                        # Channel-last view of the already ordered R,G,B planes;
+                        # no copy until normalization writes the output
+                        rgb = np.transpose(data, (1, 2, 0))
+                    else:
                         # Single band: grayscale
                         rgb = data[0, :, :]
-                    else:
-                        raise ValueError(f"Unsupported band count: {data.shape[0]}")
                     
                     # Normalize to 0-255 range
-                    if rgb.dtype in [np.float32, np.float64]:
-                        rgb_min, rgb_max = rgb.min(), rgb.max()
-                        if rgb_max > rgb_min:
-                            rgb = ((rgb - rgb_min) / (rgb_max - rgb_min) * 255).astype(np.uint8)
-                        else:
-                            rgb = np.zeros_like(rgb, dtype=np.uint8)
-                    elif rgb.dtype == np.uint16:
-                        rgb_min, rgb_max = rgb.min(), rgb.max()
-                        if rgb_max > rgb_min:
-                            rgb = ((rgb.astype(np.float32) - rgb_min) / (rgb_max - rgb_min) * 255).astype(np.uint8)
-                        else:
-                            rgb = np.zeros_like(rgb, dtype=np.uint8)
-                    elif rgb.dtype != np.uint8:
-                        rgb_min, rgb_max = rgb.min(), rgb.max()
-                        if rgb_max > rgb_min:
-                            rgb = ((rgb.astype(np.float32) - rgb_min) / (rgb_max - rgb_min) * 255).astype(np.uint8)
-                        else:
-                            rgb = np.zeros_like(rgb, dtype=np.uint8)
+                    rgb = np.ascontiguousarray(_normalize_to_uint8(rgb))
                     
                     # Create PIL Image
                     if len(rgb.shape) == 3:
@@ -181,8 +382,8 @@ def make_thumbnail(source_path: str, width: int = 300, height: int = 300) -> Opt
                         im = Image.fromarray(rgb, mode='L').convert('RGB')
                     
                     # Create thumbnail
-                    im.thumbnail((width, height), Image.LANCZOS)
-                    im.save(thumb_path, format='PNG', optimize=True)
+                    im.thumbnail((width, height), resample)
+                    _save_thumbnail(im, thumb_path)
                     
                     return thumb_path
                     
@@ -197,141 +398,282 @@ def make_thumbnail(source_path: str, width: int = 300, height: int = 300) -> Opt
                             im = im.convert('RGB')
                         elif im.mode == 'L':
                             im = im.convert('RGB')
-                        elif im.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N'):
-                            arr = np.array(im, dtype=np.float32)
-                            arr_min, arr_max = arr.min(), arr.max()
-                            if arr_max > arr_min:
-                                arr = ((arr - arr_min) / (arr_max - arr_min) * 255).astype(np.uint8)
-                            else:
-                                arr = np.zeros_like(arr, dtype=np.uint8)
-                            im = Image.fromarray(arr, mode='L').convert('RGB')
-                        elif im.mode == 'F':
-                            arr = np.array(im)
-                            arr_min, arr_max = arr.min(), arr.max()
-                            if arr_max > arr_min:
-                                arr = ((arr - arr_min) / (arr_max - arr_min) * 255).astype(np.uint8)
-                            else:
-                                arr = np.zeros_like(arr, dtype=np.uint8)
+                        elif im.mode in ('I', 'I;16', 'I;16B', 'I;16L', 'I;16N', 'F'):
+                            arr = _normalize_to_uint8(np.array(im))
                             im = Image.fromarray(arr, mode='L').convert('RGB')
                         else:
                             im = im.convert('RGB')
                         
                         # Create thumbnail
-                        im.thumbnail((width, height), Image.LANCZOS)
-                        im.save(thumb_path, format='PNG', optimize=True)
+                        im.thumbnail((width, height), resample)
+                        _save_thumbnail(im, thumb_path)
                         
                     return thumb_path
                 except Exception:
                     return None
         else:
             # Standard image processing for PNG, JPG, etc.
+            if pyvips is not None:
+                try:
+                    thumb = pyvips.Image.thumbnail(source_path, width, height=height, size='down')
+                    if thumb.hasalpha():
+                        thumb = thumb.flatten()
+                    if thumb_path.endswith('.jpg'):
+                        thumb.write_to_file(thumb_path, Q=85, interlace=True)
+                    else:
+                        thumb.write_to_file(thumb_path, compression=1)
+                    return thumb_path
+                except pyvips.Error:
+                    pass  # Fall back to PIL below
+            
             with Image.open(source_path) as im:
+                # JPEG only: let libjpeg shrink on load (2x/4x/8x) before resizing
+                im.draft('RGB', (width * 2, height * 2))
                 im = im.convert('RGB')
-                im.thumbnail((width, height), Image.LANCZOS)
-                im.save(thumb_path, format='PNG', optimize=True)
+                im.thumbnail((width, height), resample)
+                _save_thumbnail(im, thumb_path)
             return thumb_path
     except Exception:
         return None
 
 
+# Per-thread encode buffer reused by _png_data_url; it is only ever
+# overwritten, never truncated, so it keeps its grown capacity
+_PNG_BUFFERS = threading.local()
+
+
+def _png_data_url(img: Image.Image) -> str:
+    """
+    Encode `img` as a base64 PNG data URL.
+    Fast zlib level and no optimize pass: the thumbnail is built per request,
+    and the data URL is assembled as bytes and decoded once (base64 is ASCII).
+    The encoded PNG is read through a memoryview of the buffer, not copied.
+    """
+    buffer = getattr(_PNG_BUFFERS, 'buffer', None)
+    if buffer is None:
+        buffer = _PNG_BUFFERS.buffer = io.BytesIO()
+    buffer.seek(0)
+    img.save(buffer, format='PNG', optimize=False, compress_level=1)
+    size = buffer.tell()
+    # Both views must be released before the buffer can be written again
+    with buffer.getbuffer() as view, view[:size] as png_data:
+        encoded = _b64.b64encode(png_data)
+    return (b"data:image/png;base64," + encoded).decode('ascii')
+
+
+def _generate_thumbnail_base64(img_path, size=(500, 500)):
+    """ImageProcessor.generate_thumbnail_base64, at module level so pool workers can run it"""
+    try:
+        # Check if it's a PNG/JPEG file (enhanced dataset)
+        if img_path.lower().endswith(('.png', '.jpg', '.jpeg')):
+            # PNG/JPEG files are already processed and optimized
+            with Image.open(img_path) as img:
+                # JPEG only: let libjpeg decode at a reduced DCT scale (still at
+                # least twice the target size); a no-op for PNG
+                img.draft(None, (size[0] * 2, size[1] * 2))
+                
+                # Resize if needed; large downscales are first reduced by an
+                # integer factor (box filter), then finished with Lanczos
+                if img.size != size:
+                    img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                
+                # Convert to base64
+                return _png_data_url(img)
+        
+        # Legacy TIFF processing
+        with rasterio.Env(**GDAL_ENV_OPTIONS), rasterio.open(img_path) as src:
+            if src.count >= 4:
+                # Create RGB image with:
+                # R = band 4 (Red channel)
+                # G = band 3 (Green channel) 
+                # B = band 2 (Blue channel)
+                # Only these three bands are read, decimated by GDAL (from the
+                # overviews when present) to about twice the thumbnail size
+                rgb_composite = read_rgb_bands(src, size)
+                
+                # Replace NaN/Inf with 0 in place, in one pass and without checking
+                # first; integer bands cannot hold them, so they are skipped
+                if rgb_composite.dtype.kind == 'f':
+                    np.nan_to_num(rgb_composite, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+                
+                # Apply aggressive contrast stretching (same as test.py); the
+                # stretch, scale, clip and uint8 cast happen in one pass per band
+                # through a lookup table, with no float64 image buffer
+                rgb_composite = aggressive_stretch(rgb_composite)
+                
+                # Create PIL image
+                img = Image.fromarray(rgb_composite)
+                
+                # Resize to target size (upscale if needed); as above, large
+                # downscales are reduced by an integer factor first
+                img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                
+                # Encode in memory instead of a file, as base64 for web display
+                return _png_data_url(img)
+                
+            else:
+                return None
+                
+    except Exception as e:
+        return None
+
+
 class ImageProcessor:
-    def __init__(self, farm_dataset_dir, thumbnails_dir=None):
+    __slots__ = ('farm_dataset_dir', 'thumbnails_dir', 'max_cache_bytes', '_cache_bytes')
+    
+    def __init__(self, farm_dataset_dir, thumbnails_dir=None, max_cache_mb=256):
         self.farm_dataset_dir = farm_dataset_dir
-        # thumbnails_dir is no longer needed since we generate on-the-fly
+        # Generated data URLs are cached on disk, one subdirectory per farm,
+        # keyed by source path, mtime and size; the least recently used
+        # entries are dropped once the cache grows past max_cache_mb
+        self.thumbnails_dir = thumbnails_dir or DATA_URL_CACHE_DIR
+        self.max_cache_bytes = max_cache_mb * 1024 * 1024
+        self._cache_bytes = None  # Total size of the cache, scanned on first write
+        os.makedirs(self.thumbnails_dir, exist_ok=True)
         
     def generate_thumbnail_base64(self, img_path, size=(500, 500)):
         """
         Generate high-resolution thumbnail in memory and return as base64 string
-        Handles both TIFF (legacy) and PNG (enhanced dataset) files
+        Handles both TIFF (legacy) and PNG/JPEG (enhanced dataset) files
         
         Args:
-            img_path (str): Path to the original TIFF or PNG file
+            img_path (str): Path to the original TIFF, PNG or JPEG file
             size (tuple): Thumbnail size (width, height)
         
         Returns:
             str: Base64 encoded PNG image, or None if failed
         """
+        cache_path = self._cache_path(img_path, size)
+        if cache_path is None:
+            return None
+        data_url = self._cache_load(cache_path)
+        if data_url is None:
+            data_url = _generate_thumbnail_base64(img_path, size)
+            if data_url is not None:
+                self._cache_store(cache_path, data_url)
+        return data_url
+    
+    def generate_thumbnails_batch(self, img_paths, size=(500, 500), max_workers=None):
+        """
+        Generate thumbnails for many images across a process pool
+        (decoding and contrast stretching are CPU-bound and hold the GIL)
+        
+        Args:
+            img_paths (list): Paths to TIFF, PNG or JPEG files
+            size (tuple): Thumbnail size (width, height)
+            max_workers (int): Worker processes, defaults to the CPU count
+        
+        Returns:
+            list: Base64 data URLs (None for failures), in the order of img_paths
+        """
+        img_paths = list(img_paths)
+        cache_paths = [self._cache_path(p, size) for p in img_paths]
+        results = [self._cache_load(c) if c is not None else None for c in cache_paths]
+        
+        # Only cache misses go to the pool
+        missing = [i for i, (c, r) in enumerate(zip(cache_paths, results))
+                   if c is not None and r is None]
+        if len(missing) <= 1:
+            generated = [_generate_thumbnail_base64(img_paths[i], size) for i in missing]
+        else:
+            max_workers = min(max_workers or os.cpu_count() or 1, len(missing))
+            chunksize = max(1, min(4, len(missing) // (max_workers * 4)))
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                generated = list(executor.map(_generate_thumbnail_base64,
+                                              [img_paths[i] for i in missing], repeat(size),
+                                              chunksize=chunksize))
+        
+        for i, data_url in zip(missing, generated):
+            results[i] = data_url
+            if data_url is not None:
+                self._cache_store(cache_paths[i], data_url)
+        return results
+    
+    def _cache_path(self, img_path, size):
+        """Cache file for the thumbnail of `img_path` at `size`, or None if the image is missing"""
         try:
-            # Check if it's a PNG file (enhanced dataset)
-            if img_path.lower().endswith('.png'):
-                # PNG files are already processed and optimized
-                with Image.open(img_path) as img:
-                    # Resize if needed
-                    if img.size != size:
-                        img = img.resize(size, Image.Resampling.LANCZOS)
-                    
-                    # Convert to base64
-                    buffer = io.BytesIO()
-                    img.save(buffer, format='PNG', optimize=True)
-                    buffer.seek(0)
-                    
-                    img_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-                    return f"data:image/png;base64,{img_base64}"
-            
-            # Legacy TIFF processing
-            with rasterio.open(img_path) as src:
-                bands = src.read()
-                
-                if bands.shape[0] >= 4:
-                    # Create RGB image with:
-                    # R = band 4 (Red channel)
-                    # G = band 3 (Green channel) 
-                    # B = band 2 (Blue channel)
-                    # Band indexing: rasterio uses 0-based, so band 4=index 3, band 3=index 2, band 2=index 1
-                    rgb_composite = np.stack([bands[3], bands[2], bands[1]], axis=-1)  # R, G, B
-                    
-                    # Check for invalid values
-                    if np.any(np.isnan(rgb_composite)) or np.any(np.isinf(rgb_composite)):
-                        # Replace NaN/Inf with 0
-                        rgb_composite = np.nan_to_num(rgb_composite, nan=0.0, posinf=0.0, neginf=0.0)
-                    
-                    # Apply aggressive contrast stretching (same as test.py)
-                    def aggressive_stretch(rgb_array, percentile_range=(0.5, 99.5)):
-                        result = np.zeros_like(rgb_array, dtype=np.float64)
-                        for i in range(3):
-                            band = rgb_array[:, :, i].astype(np.float64)
-                            non_zero = band[band > 0]
-                            if len(non_zero) > 0:
-                                p_low, p_high = np.percentile(non_zero, percentile_range)
-                            else:
-                                p_low, p_high = np.percentile(band, percentile_range)
-                            if p_high > p_low:
-                                result[:, :, i] = (band - p_low) / (p_high - p_low)
-                            else:
-                                result[:, :, i] = band / np.max(band) if np.max(band) > 0 else band
-                        return np.clip(result * 255, 0, 255).astype(np.uint8)
-                    
-                    # Apply the aggressive stretch
-                    rgb_composite = aggressive_stretch(rgb_composite)
-                    
-                    # Create PIL image
-                    img = Image.fromarray(rgb_composite)
-                    
-                    # Resize to target size (upscale if needed)
-                    img = img.resize(size, Image.Resampling.LANCZOS)
-                    
-                    # Save to memory buffer instead of file
-                    buffer = io.BytesIO()
-                    img.save(buffer, format='PNG', optimize=False, compress_level=1)
-                    buffer.seek(0)
-                    
-                    # Convert to base64 for web display
-                    img_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-                    
-                    return f"data:image/png;base64,{img_base64}"
-                    
-                else:
-                    return None
-                    
-        except Exception as e:
+            mtime = os.stat(img_path).st_mtime_ns
+        except OSError:
             return None
+        rel_path = os.path.relpath(os.path.abspath(img_path), os.path.abspath(self.farm_dataset_dir))
+        parts = rel_path.split(os.sep, 1)
+        farm_id = parts[0] if len(parts) == 2 and parts[0] != '..' else '_other'
+        key = _cachehash(f"{img_path}:{mtime}:{size[0]}x{size[1]}")
+        return os.path.join(self.thumbnails_dir, farm_id, f"{key}.b64")
+    
+    def _cache_load(self, cache_path):
+        """Cached data URL, or None on a miss; a hit marks the entry as recently used"""
+        try:
+            with open(cache_path, 'r', encoding='ascii') as f:
+                data_url = f.read()
+            os.utime(cache_path)
+            return data_url
+        except OSError:
+            return None
+    
+    def _cache_store(self, cache_path, data_url):
+        """Write a data URL to the cache atomically, then evict if over the size limit"""
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.tmp{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'w', encoding='ascii') as f:
+                f.write(data_url)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        
+        if self._cache_bytes is None:
+            self._cache_bytes = sum(size for _, size, _ in self._cache_entries())
+        else:
+            self._cache_bytes += len(data_url)
+        if self._cache_bytes > self.max_cache_bytes:
+            self.cleanup_thumbnails()
+    
+    def _cache_entries(self):
+        """(mtime, size, path) of every cached data URL"""
+        entries = []
+        with os.scandir(self.thumbnails_dir) as farms:
+            for farm in farms:
+                if farm.is_dir():
+                    with os.scandir(farm.path) as files:
+                        for e in files:
+                            # Skip leftovers of interrupted writes
+                            if e.is_file() and '.tmp' not in e.name:
+                                st = e.stat()
+                                entries.append((st.st_mtime_ns, st.st_size, e.path))
+        return entries
     
     def cleanup_thumbnails(self, keep_farms=None):
         """
-        No longer needed - thumbnails are generated on-demand and not saved
+        Drop cached thumbnails of farms not in keep_farms (if given), then the
+        least recently used ones until the cache is back under 90% of its limit
         """
-        pass
+        if keep_farms is not None:
+            keep = set(keep_farms)
+            with os.scandir(self.thumbnails_dir) as farms:
+                for farm in farms:
+                    if farm.is_dir() and farm.name not in keep:
+                        shutil.rmtree(farm.path, ignore_errors=True)
+        
+        entries = sorted(self._cache_entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_cache_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._cache_bytes = total
     
     def get_thumbnail_stats(self):
-        """Get statistics about generated thumbnails - now always zero since not saved"""
-        return {'total': 0, 'size_mb': 0, 'note': 'Thumbnails generated on-demand, not saved'}
\ No newline at end of file
+        """Get statistics about the cached thumbnails"""
+        entries = self._cache_entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        return {'total': len(entries), 'size_mb': round(total_bytes / (1024 * 1024), 2)}
@@ -14,8 +14,9 @@ def list_all_farms():
         print(f"Error: Farm dataset directory not found: {FARM_DATASET_DIR}")
         return
     
-    farm_dirs = [d for d in os.listdir(FARM_DATASET_DIR)
-                 if os.path.isdir(os.path.join(FARM_DATASET_DIR, d)) and d != "0"]
+    with os.scandir(FARM_DATASET_DIR) as entries:
+        farm_dirs = [e.name for e in entries
+                     if e.is_dir(follow_symlinks=False) and e.name != "0"]
     farm_dirs.sort()
     
     print(f"\n{'='*60}")
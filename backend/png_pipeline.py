@@ -0,0 +1,325 @@
+"""
+Shared TIF -> PNG conversion helpers for the PNG dataset creators
+(create_png_dataset.py): contrast stretching, band reading, PNG encoding,
+and date parsing / scanning of the imgs_24_25 temporal images.
+The GDAL settings and stretch helpers are also used by
+create_enhanced_dataset.py and image_utils.ImageProcessor
+"""
+
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from PIL import Image
+
+
+# GDAL settings for TIFF reads (dataset scripts and thumbnails): a bigger
+# block cache, no sidecar-file directory listing on open (image folders
+# hold many files), the TIFF header fetched in one read, and buffered
+# small reads
+GDAL_ENV_OPTIONS = {
+    'GDAL_CACHEMAX': 512,
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'GDAL_INGESTED_BYTES_AT_OPEN': 32768,
+    'VSI_CACHE': True,
+    'VSI_CACHE_SIZE': 256 * 1024 * 1024,
+    'CPL_VSIL_CURL_ALLOWED_EXTENSIONS': '.tif',
+}
+
+# Per-process GDAL environment of pool workers, set up once by init_gdal_worker
+_worker_env = None
+
+def worker_gdal_threads(max_workers):
+    """GDAL decompression threads per pool worker: the cores the workers leave over"""
+    return max(1, (os.cpu_count() or 1) // max_workers)
+
+def init_gdal_worker(gdal_threads=1):
+    """Process pool initializer: keep a GDAL environment for the worker's lifetime"""
+    global _worker_env
+    _worker_env = rasterio.Env(GDAL_NUM_THREADS=gdal_threads, **GDAL_ENV_OPTIONS)
+    _worker_env.__enter__()
+
+def histogram_percentiles(counts, percentiles):
+    """
+    Percentiles (numpy's default linear interpolation) of the integer values
+    whose histogram is `counts`; one cumulative pass instead of a sort
+    """
+    cumulative = np.cumsum(counts)
+    positions = np.asarray(percentiles, dtype=np.float64) / 100 * (cumulative[-1] - 1)
+    below = np.floor(positions)
+    above = np.minimum(below + 1, cumulative[-1] - 1)
+    v_below = np.searchsorted(cumulative, below, side='right')
+    v_above = np.searchsorted(cumulative, above, side='right')
+    return v_below + (positions - below) * (v_above - v_below)
+
+def band_stretch_limits(rgb_array, percentile_range):
+    """Per-band (p_low, p_high, max) of the non-zero pixels, used by aggressive_stretch"""
+    n_bands = rgb_array.shape[2]
+    p_low = np.empty(n_bands, dtype=np.float64)
+    p_high = np.empty(n_bands, dtype=np.float64)
+    band_max = np.empty(n_bands, dtype=np.float64)
+    
+    if rgb_array.dtype.kind == 'u' and rgb_array.dtype.itemsize <= 2:
+        # 8/16-bit imagery: one bincount per band gives the percentiles of the
+        # non-zero pixels (bin 0 dropped) and of the whole band alike
+        for b in range(n_bands):
+            counts = np.bincount(rgb_array[:, :, b].ravel())
+            band_max[b] = len(counts) - 1
+            if counts[1:].any():
+                counts[0] = 0
+            p_low[b], p_high[b] = histogram_percentiles(counts, percentile_range)
+        return p_low, p_high, band_max
+    
+    # Float imagery: all bands in one nanpercentile call with zeros masked;
+    # bands with no positive pixel fall back to percentiles of the whole band.
+    # The bands are only read here, so float32 input is used without a copy
+    bands = rgb_array.astype(np.float32, copy=False)
+    positive = bands > 0
+    has_data = positive.any(axis=(0, 1))
+    if has_data.any():
+        non_zero = np.where(positive[:, :, has_data], bands[:, :, has_data], np.nan)
+        p_low[has_data], p_high[has_data] = np.nanpercentile(non_zero, percentile_range, axis=(0, 1))
+    if not has_data.all():
+        p_low[~has_data], p_high[~has_data] = np.percentile(bands[:, :, ~has_data], percentile_range, axis=(0, 1))
+    band_max[:] = bands.max(axis=(0, 1))
+    return p_low, p_high, band_max
+
+def aggressive_stretch(rgb_array, percentile_range=(0.5, 99.5)):
+    """Apply aggressive contrast stretching for better visualization"""
+    p_low, p_high, band_max = band_stretch_limits(rgb_array, percentile_range)
+    
+    # Flat bands are scaled by their maximum instead. Divide by the span
+    # rather than multiplying by its reciprocal so the top of the range
+    # lands on exactly 255 (x / x is exact, x * (1 / x) need not be)
+    stretch = p_high > p_low
+    offset = np.where(stretch, p_low, 0.0)
+    span = np.where(stretch, p_high - p_low, np.where(band_max > 0, band_max, 1.0))
+    
+    if rgb_array.dtype.kind == 'u' and rgb_array.dtype.itemsize <= 2:
+        # Integer imagery: stretch each possible level once into a lookup
+        # table, then map the band through it in a single pass with no float
+        # temporaries of the image
+        result = np.empty(rgb_array.shape, dtype=np.uint8)
+        for b in range(rgb_array.shape[2]):
+            if band_max[b] == 0:
+                # All-zero band (e.g. a no-data tile): the histogram already
+                # says it maps to 0, so fill instead of building and applying a table
+                result[:, :, b] = 0
+                continue
+            levels = np.arange(int(band_max[b]) + 1, dtype=np.float64)
+            levels -= offset[b]
+            levels /= span[b]
+            levels *= 255
+            lut = np.clip(levels, 0, 255, out=levels).astype(np.uint8)
+            np.take(lut, rgb_array[:, :, b], out=result[:, :, b], mode='clip')
+        return result
+    
+    # Affine scale and clip in place on a float32 copy
+    bands = rgb_array.astype(np.float32)
+    bands -= offset.astype(np.float32)
+    bands /= span.astype(np.float32)
+    bands *= 255
+    return np.clip(bands, 0, 255, out=bands).astype(np.uint8)
+
+def read_rgb_bands(src, size):
+    """
+    Read only bands 4, 3, 2 (R, G, B) as an (H, W, 3) array.
+    Scenes much larger than the output `size` are decimated by GDAL on read
+    (from overviews when present) down to about twice the output size, which
+    still leaves the final Lanczos resize some detail to work with.
+    """
+    scale = max(1.0, min(src.width / (2 * size[0]), src.height / (2 * size[1])))
+    out_shape = (3, max(1, int(src.height / scale)), max(1, int(src.width / scale)))
+    rgb = src.read([4, 3, 2], out_shape=out_shape, resampling=Resampling.average)
+    return np.transpose(rgb, (1, 2, 0))
+
+def convert_tif_to_png(tif_path, png_path, size=(500, 500)):
+    """Convert TIF to PNG with RGB band mapping and aggressive stretching"""
+    try:
+        with rasterio.open(tif_path) as src:
+            if src.count >= 4:
+                # RGB mapping: R=Band4, G=Band3, B=Band2
+                rgb_composite = read_rgb_bands(src, size)
+                
+                # Handle invalid values: zero NaN/Inf in place in one pass
+                # (the array was just read, and integer bands cannot hold them)
+                if rgb_composite.dtype.kind == 'f':
+                    np.nan_to_num(rgb_composite, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+                
+                # Apply aggressive contrast stretching
+                rgb_composite = aggressive_stretch(rgb_composite)
+                
+                # Create PIL image and resize; large downscales are first
+                # reduced by an integer factor, then finished with Lanczos
+                img = Image.fromarray(rgb_composite)
+                img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                
+                # Save as PNG; fast zlib level, since the dataset is regenerated in bulk
+                img.save(png_path, format='PNG', optimize=False, compress_level=1)
+                return True
+            else:
+                print(f"⚠️  Insufficient bands: {tif_path}")
+                return False
+                
+    except Exception as e:
+        print(f"❌ Error converting {tif_path}: {e}")
+        return False
+
+# Month folders of the imgs_24_25 layout and their month numbers
+_MONTH_FOLDERS = {
+    'Oct': 10, 'Nov': 11, 'Dec': 12,
+    'Jan': 1, 'Feb': 2, 'March': 3, 'April': 4
+}
+# Day folders end with their month name, full or abbreviated (e.g. 11Oct, 12Mar)
+_FOLDER_MONTH_SUFFIX = re.compile(r'(?:Oct|Nov|Dec|Jan|Feb|Mar(?:ch)?|Apr(?:il)?)$')
+
+# Month names accepted in filenames
+_FILENAME_MONTHS = {
+    'jan': 1, 'january': 1, 'feb': 2, 'february': 2,
+    'mar': 3, 'march': 3, 'apr': 4, 'april': 4,
+    'may': 5, 'jun': 6, 'june': 6, 'jul': 7, 'july': 7,
+    'aug': 8, 'august': 8, 'sep': 9, 'sept': 9, 'september': 9,
+    'oct': 10, 'october': 10, 'nov': 11, 'november': 11,
+    'dec': 12, 'december': 12
+}
+
+_LEADING_DAY = re.compile(r'(\d+)')
+_FILENAME_DATE_PATTERNS = [re.compile(p) for p in (
+    r'([a-z]+)_(\d{4})',
+    r'(\d+)([a-z]+),(\d{4})',
+    r'(\d+)([a-z]+)(\d{4})',
+    r'([a-z]+)(\d+)_(\d{4})',
+)]
+
+def parse_date_from_path(folder_path):
+    """
+    Parse date from imgs_24_25 folder structure
+    Format: imgs_24_25/Month/DayMonth/ (e.g. Oct/11Oct/ -> (2024, 10, 11))
+    Only parts ending in a month name count as the day folder, so scene
+    subfolders like 20241011_052312_24b5_psscene_... are ignored.
+    """
+    parts = Path(folder_path).parts
+    
+    month_name = None
+    day_month = None
+    
+    for part in parts:
+        if part in _MONTH_FOLDERS:
+            month_name = part
+        elif _FOLDER_MONTH_SUFFIX.search(part):
+            day_month = part
+    
+    if not month_name or not day_month:
+        return None
+    
+    # Extract day from day_month (e.g., "11Oct" -> 11)
+    day_match = _LEADING_DAY.match(day_month)
+    if not day_match:
+        return None
+    
+    day = int(day_match.group(1))
+    month = _MONTH_FOLDERS[month_name]
+    
+    # Oct-Dec belong to 2024, Jan-April to 2025
+    year = 2024 if month >= 10 else 2025
+    
+    return (year, month, day)
+
+def parse_date_from_path_and_filename(folder_path, filename):
+    """Enhanced date parsing from both folder structure and filename"""
+    # Method 1: Parse from folder structure (e.g., imgs_24_25/Oct/11Oct/)
+    date_tuple = parse_date_from_path(folder_path)
+    if date_tuple:
+        return date_tuple
+    
+    # Method 2: Parse from filename (fallback)
+    filename_lower = filename.lower()
+    
+    for pattern in _FILENAME_DATE_PATTERNS:
+        match = pattern.search(filename_lower)
+        if match:
+            groups = match.groups()
+            if len(groups) == 2:
+                month_str, year_str = groups
+                if month_str in _FILENAME_MONTHS:
+                    return (int(year_str), _FILENAME_MONTHS[month_str], 1)
+            elif len(groups) == 3:
+                if groups[0].isdigit():
+                    day_str, month_str, year_str = groups
+                    if month_str in _FILENAME_MONTHS:
+                        return (int(year_str), _FILENAME_MONTHS[month_str], int(day_str))
+                else:
+                    month_str, day_str, year_str = groups
+                    if month_str in _FILENAME_MONTHS:
+                        return (int(year_str), _FILENAME_MONTHS[month_str], int(day_str))
+    
+    # Default fallback
+    return (2024, 1, 1)
+
+def _scan_temporal_images(root, unique_images):
+    """
+    Collect dated TIFFs under `root` (top-down, like os.walk) with os.scandir,
+    keeping the first image found for each date
+    """
+    subdirs = []
+    
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.lower().endswith('.tif') and not entry.name.endswith('_udm2.tif'):
+                date_tuple = parse_date_from_path_and_filename(root, entry.name)
+                
+                if date_tuple:
+                    year, month, day = date_tuple
+                    # Create standardized filename
+                    png_name = f"{year:04d}_{month:02d}_{day:02d}.png"
+                    if png_name not in unique_images:
+                        unique_images[png_name] = (date_tuple, entry.path, png_name)
+    
+    for subdir in subdirs:
+        _scan_temporal_images(subdir, unique_images)
+
+def find_all_temporal_images(imgs_24_25_dir):
+    """Find all temporal images in imgs_24_25 directory, one per date, sorted by date"""
+    unique_images = {}
+    _scan_temporal_images(imgs_24_25_dir, unique_images)
+    return sorted(unique_images.values(), key=lambda x: x[0])
+
+def _scan_dated_folder(root, temporal_images):
+    """Collect TIFFs under `root` (top-down, like os.walk), dated by their folder"""
+    subdirs = []
+    date_tuple = None
+    date_parsed = False
+    
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.endswith('.tif') and not entry.name.endswith('_udm2.tif'):
+                # Parse date from folder path (once per folder)
+                if not date_parsed:
+                    date_tuple = parse_date_from_path(root)
+                    date_parsed = True
+                
+                if date_tuple:
+                    year, month, day = date_tuple
+                    
+                    # Create consistent naming: YYYY_MM_DD.png
+                    png_name = f"{year:04d}_{month:02d}_{day:02d}.png"
+                    
+                    temporal_images.append((date_tuple, entry.path, png_name))
+    
+    for subdir in subdirs:
+        _scan_dated_folder(subdir, temporal_images)
+
+def get_temporal_images_from_imgs_24_25(imgs_24_25_dir):
+    """
+    Scan imgs_24_25 directory and get all temporal images
+    """
+    temporal_images = []
+    _scan_dated_folder(imgs_24_25_dir, temporal_images)
+    return temporal_images
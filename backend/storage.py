@@ -4,6 +4,8 @@ Provides unified interface for file operations
 """
 import os
 import io
+import threading
+from collections import OrderedDict
 from typing import List, Tuple, Optional, BinaryIO
 from datetime import datetime
 import boto3
@@ -35,6 +37,14 @@ class StorageBackend:
     def image_exists(self, farm_id: str, image_path: str) -> bool:
         """Check if image exists"""
         raise NotImplementedError
+    
+    def get_local_path(self, farm_id: str, image_path: str) -> Optional[str]:
+        """Filesystem path of an image, or None if the backend is not local"""
+        return None
+    
+    def get_mtime(self, farm_id: Optional[str] = None) -> Optional[int]:
+        """Modification time (ns) of the dataset root or of a farm, or None if not tracked"""
+        return None
 
 
 class LocalStorage(StorageBackend):
@@ -48,10 +58,12 @@ class LocalStorage(StorageBackend):
     def list_farms(self) -> List[str]:
         """List all farm directories"""
         try:
-            farms = [
-                d for d in os.listdir(self.base_path)
-                if os.path.isdir(os.path.join(self.base_path, d)) and d != "0"
-            ]
+            # scandir entries carry the d_type from readdir, so no stat per farm
+            with os.scandir(self.base_path) as entries:
+                farms = [
+                    e.name for e in entries
+                    if e.is_dir(follow_symlinks=False) and e.name != "0"
+                ]
             return sorted(farms)
         except Exception as e:
             print(f"Error listing farms: {e}")
@@ -64,16 +76,18 @@ class LocalStorage(StorageBackend):
             return []
         
         images = []
-        for root, dirs, files in os.walk(farm_path):
-            for f in files:
-                if f.lower().endswith(('.tif', '.tiff', '.png', '.jpg', '.jpeg')):
-                    full_path = os.path.join(root, f)
-                    # Get relative path from farm directory
-                    rel_path = os.path.relpath(full_path, farm_path)
-                    images.append(rel_path.replace('\\', '/'))
-        
+        self._scan_images(farm_path, '', images)
         return images
     
+    def _scan_images(self, dir_path: str, prefix: str, images: List[str]):
+        """Collect image paths under `dir_path` (relative, '/'-separated) with os.scandir"""
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    self._scan_images(entry.path, f"{prefix}{entry.name}/", images)
+                elif entry.name.lower().endswith(('.tif', '.tiff', '.png', '.jpg', '.jpeg')):
+                    images.append(prefix + entry.name)
+    
     def get_image(self, farm_id: str, image_path: str) -> bytes:
         """Read image file"""
         full_path = os.path.join(self.base_path, farm_id, image_path)
@@ -91,16 +105,52 @@ class LocalStorage(StorageBackend):
         """Check if image file exists"""
         full_path = os.path.join(self.base_path, farm_id, image_path)
         return os.path.isfile(full_path)
+    
+    def get_local_path(self, farm_id: str, image_path: str) -> Optional[str]:
+        """Image files are already on disk"""
+        return os.path.join(self.base_path, farm_id, image_path)
+    
+    def get_mtime(self, farm_id: Optional[str] = None) -> Optional[int]:
+        """
+        Directory mtime; it changes whenever an entry is added, removed or renamed.
+        For a farm this is the newest mtime of the farm directory and every
+        directory below it, since list_images recurses into nested folders.
+        """
+        if farm_id is None:
+            try:
+                return os.stat(self.base_path).st_mtime_ns
+            except OSError:
+                return None
+        try:
+            return self._tree_mtime(os.path.join(self.base_path, farm_id))
+        except OSError:
+            return None
+    
+    def _tree_mtime(self, dir_path: str) -> int:
+        """Newest st_mtime_ns of `dir_path` and its subdirectories (only directories are stat'ed)"""
+        newest = os.stat(dir_path).st_mtime_ns
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    newest = max(newest, self._tree_mtime(entry.path))
+        return newest
 
 
 class S3Storage(StorageBackend):
     """AWS S3 storage"""
     
-    def __init__(self, bucket_name: str, region: str = 'ap-south-1', prefix: str = 'farm_dataset/'):
+    def __init__(self, bucket_name: str, region: str = 'ap-south-1', prefix: str = 'farm_dataset/',
+                 cache_bytes: int = 256 * 1024 * 1024):
         self.bucket_name = bucket_name
         self.region = region
         self.prefix = prefix
         
+        # LRU cache of downloaded image bytes, bounded by total size
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cache_size = 0
+        self._cache_max = cache_bytes
+        self._cache_lock = threading.Lock()
+        
         # Initialize S3 client
         try:
             self.s3_client = boto3.client(
@@ -166,15 +216,31 @@ class S3Storage(StorageBackend):
             return []
     
     def get_image(self, farm_id: str, image_path: str) -> bytes:
-        """Download image from S3"""
+        """Download image from S3 (recently used images are served from memory)"""
+        key = f"{self.prefix}{farm_id}/{image_path}"
+        with self._cache_lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                return data
+        
         try:
-            key = f"{self.prefix}{farm_id}/{image_path}"
             response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
-            return response['Body'].read()
+            data = response['Body'].read()
         except ClientError as e:
             if e.response['Error']['Code'] == 'NoSuchKey':
                 raise FileNotFoundError(f"Image not found in S3: {image_path}")
             raise
+        
+        if len(data) <= self._cache_max:
+            with self._cache_lock:
+                if key not in self._cache:
+                    self._cache[key] = data
+                    self._cache_size += len(data)
+                while self._cache_size > self._cache_max:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_size -= len(evicted)
+        return data
     
     def farm_exists(self, farm_id: str) -> bool:
         """Check if farm exists in S3"""
@@ -210,8 +276,10 @@ def get_storage() -> StorageBackend:
         if not bucket_name:
             raise ValueError("S3_BUCKET_NAME not set in environment variables")
         
+        cache_mb = int(os.getenv('S3_IMAGE_CACHE_MB', '256'))
+        
         print(f"🪣 Using S3 storage: {bucket_name}")
-        return S3Storage(bucket_name, region)
+        return S3Storage(bucket_name, region, cache_bytes=cache_mb * 1024 * 1024)
     else:
         # Use local storage
         root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -9,6 +9,7 @@ import os
 sys.path.append('/media/karan/Loni SSD/karan_dev/app')
 
 from app import parse_date_from_filename
+from png_pipeline import parse_date_from_path
 
 def test_date_parsing():
     """Test the date parsing function with various filename formats"""
@@ -84,5 +85,29 @@ def test_date_parsing():
         
         print(f"  {f:<40} ({date_display})")
 
+def test_folder_date_parsing():
+    """Test the imgs_24_25 folder date parser, including scene subfolders"""
+    
+    test_cases = [
+        ("/d/imgs_24_25/Oct/11Oct", (2024, 10, 11)),
+        ("/d/imgs_24_25/Nov/28Nov", (2024, 11, 28)),
+        ("/d/imgs_24_25/March/12Mar", (2025, 3, 12)),
+        ("/d/imgs_24_25/April/24April", (2025, 4, 24)),
+        # Digit-leading scene subfolders must not be taken for the day folder
+        ("/d/imgs_24_25/Oct/11Oct/20241011_052312_24b5_psscene_analytic_8b_sr_udm2", (2024, 10, 11)),
+        ("/d/imgs_24_25/Oct/20241011_052312_24b5_psscene_analytic_8b_sr_udm2", None),
+    ]
+    
+    print("\n📁 Testing Folder Date Parsing")
+    print("=" * 50)
+    
+    for folder, expected in test_cases:
+        result = parse_date_from_path(folder)
+        status = "✅" if result == expected else "❌"
+        print(f"{status} {folder} → {result}")
+        if result != expected:
+            print(f"   Expected: {expected}, Got: {result}")
+
 if __name__ == "__main__":
-    test_date_parsing()
\ No newline at end of file
+    test_date_parsing()
+    test_folder_date_parsing()
\ No newline at end of file